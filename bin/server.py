@@ -15,27 +15,155 @@
 
 import fcntl
 import os
-import pty
 import signal
-import socket  # only for gethostname()
+import socket
 import struct
-import sys
 import termios
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 import tornado.httpserver
 import tornado.options
 import tornado.web
-from tornado.ioloop import IOLoop
+from tornado.escape import json_encode
+from tornado.ioloop import IOLoop, PeriodicCallback
+from tornado.log import app_log
+from tornado.netutil import bind_sockets
 from tornado.options import define, options
+from tornado.process import cpu_count
 from tornado.websocket import WebSocketHandler
 
-from gits.terminal import Terminal
+from gits.metrics import CONTENT_TYPE, Registry
+from gits.recording import Recorder
+from gits.scheduling import (Backpressure, FairShare, RenderScheduler,
+                             SerialExecutor, Usage, timed)
+from gits.sessions import (READ_BUFFER_SIZE, DetachedSessions, ShellPool,
+                           kill_shell, new_token, spawn_shell)
+from gits.supervisor import supervise
+from gits.terminal import Terminal, load_sequences
 
 define('port', help='listen on a specific port', default=8888)
 define('static_path', help='the path to static resources',
        default=os.path.join(os.getcwd(), 'node_modules/gits-client/static'))
 define('templates_path', help='the path to templates',
        default=os.path.join(os.getcwd(), 'node_modules/gits-client/templates'))
+define('sequences_cache', help='the file the compiled escape sequence tables '
+                               'are cached in, so they are not built on '
+                               'every start (no caching, if not specified)',
+       default='')
+define('workers', help='the number of worker processes (0 means the '
+                       'number of CPUs); several workers turn detach_grace '
+                       'and share off',
+       default=1)
+define('render_threads', help='the number of threads parsing the output of '
+                              'programs and rendering frames (0 means doing '
+                              'it in the IOLoop)',
+       default=0)
+define('max_queued_jobs', help='the maximum number of jobs queued for a '
+                               'terminal before reading from it is paused',
+       default=16)
+define('max_fps', help='the maximum number of frames per second sent to '
+                       'a client (0 means no limit)',
+       default=30)
+define('coalesce_ms', help='the time (in milliseconds) to wait for more '
+                           'output before sending a frame',
+       default=5)
+define('scrollback', help='the number of rows kept in the scrollback of '
+                          'each terminal (each row takes up to 8 bytes per '
+                          'column)',
+       default=1000)
+define('pool_size', help='the number of shells started in advance, so the '
+                         'clients don\'t wait for them to start',
+       default=0)
+define('pool_max_idle', help='the time (in seconds) after which an unused '
+                             'shell started in advance is replaced (must be '
+                             'less than the login timeout)',
+       default=50)
+define('detach_grace', help='the time (in seconds) a terminal is kept after '
+                            'its client has disconnected, so the client can '
+                            'reattach to it (0 means hanging up at once)',
+       default=60)
+define('share', help='let the clients share their terminals with other '
+                     'clients',
+       default=True)
+define('max_detached', help='the maximum number of detached terminals',
+       default=16)
+define('max_detached_mb', help='the maximum memory (in megabytes) taken '
+                               'by the screens and the scrollbacks of the '
+                               'detached terminals',
+       default=64)
+define('record_dir', help='the directory the sessions are recorded to (no '
+                          'recording, if not specified)',
+       default='')
+define('record_input', help='record the input of the sessions as well',
+       default=False)
+define('record_compress', help='compress the recordings with zlib',
+       default=True)
+define('record_max_mb', help='the size (in megabytes) of a recording file, '
+                             'after which the next file is started (0 means '
+                             'no limit)',
+       default=64)
+define('record_flush_s', help='the interval (in seconds) between writing '
+                              'the recorded data to the files',
+       default=1)
+define('send_high_water', help='the number of bytes queued for sending to a '
+                               'client, at which reading from its terminal '
+                               'is paused',
+       default=1024 * 1024)
+define('send_low_water', help='the number of bytes queued for sending to a '
+                              'client, at which reading from its terminal '
+                              'is resumed',
+       default=256 * 1024)
+define('metrics', help='expose the metrics of the server at /metrics in the '
+                       'Prometheus text format',
+       default=True)
+define('metrics_port', help='the port the metrics are exposed on, each '
+                            'worker uses the port plus its index (0 means '
+                            'the main port, which is possible with one '
+                            'worker only)',
+       default=0)
+define('tick_ms', help='the length (in milliseconds) of the period the '
+                       'budgets of the terminals are given for',
+       default=100)
+define('tick_bytes', help='the number of bytes of output read from a '
+                          'terminal per tick (0 means no limit)',
+       default=256 * 1024)
+define('tick_cpu_ms', help='the CPU time (in milliseconds) spent on a '
+                           'terminal per tick (0 means no limit)',
+       default=25)
+define('interactive_s', help='the time (in seconds) a terminal stays '
+                             'interactive after the user has typed into it',
+       default=2)
+define('usage_report_s', help='the interval (in seconds) between logging the '
+                              'resources consumed by each terminal (0 means '
+                              'only when the terminal is closed)',
+       default=300)
+
+# The WebSocket subprotocol, which enables the binary protocol (see
+# Terminal.generate_cells_patch). The clients, which don't request it,
+# receive patches in JSON.
+CELLS_PROTOCOL = 'gits.cells'
+
+# The time (in seconds) given to the connections to be closed when the server
+# is shutting down.
+SHUTDOWN_TIMEOUT = 1
+
+# The maximum number of bytes read from a terminal in one IOLoop iteration.
+MAX_DRAIN = 4 * READ_BUFFER_SIZE
+
+# Resizing is delayed by the time (in seconds), so the burst of the resize
+# messages sent while the user is dragging the window results in resizing
+# the terminal once.
+RESIZE_DELAY = 0.1
+
+# The maximum number of rows and columns of a terminal.
+MAX_SIZE = 1000
+
+# The IOLoop lag is measured by scheduling a callback every interval (in
+# seconds) and observing how late it's called. See ServerMetrics.
+LAG_PROBE_INTERVAL = 0.5
+LAG_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0,
+               2.5, 5.0)
 
 
 class IndexHandler(tornado.web.RequestHandler):
@@ -48,106 +176,704 @@ class ControlPanelHandler(tornado.web.RequestHandler):
         self.render('control-panel.htm')
 
 
+class MetricsHandler(tornado.web.RequestHandler):
+    def initialize(self, metrics):
+        self._metrics = metrics
+
+    def get(self):
+        self.set_header('Content-Type', CONTENT_TYPE)
+        self.write(self._metrics.registry.expose())
+
+
+def render_frames(terminal, formats, full_formats):
+    """Renders the patches of ``terminal`` once per format for all its
+    clients and encodes them (see Terminal.generate_patches). The clients
+    which have missed some patches get the full screen in one of
+    ``full_formats``. Returns a dictionary mapping the pairs ``(format,
+    full)`` to the messages. There are no messages with the changes, if
+    nothing has changed since the last frame.
+    """
+    frames = {}
+    for full, wanted in ((False, formats), (True, full_formats)):
+        if not wanted:
+            continue
+
+        for fmt, patch in terminal.generate_patches(wanted, full).items():
+            frames[fmt, full] = patch if fmt == 'cells' else json_encode(patch)
+
+    return frames
+
+
+class ServerMetrics:
+    """The metrics of the server, see gits.metrics. The counters and the
+    histograms are updated by the handlers in the IOLoop. The numbers of the
+    sessions are taken from the ``sessions`` dictionary (see
+    TermSocketHandler.clients) and ``detached`` (see DetachedSessions) when
+    the metrics are exposed.
+    """
+
+    def __init__(self, io_loop, sessions):
+        self._io_loop = io_loop
+        self._detached = ()
+
+        registry = self.registry = Registry()
+        registry.gauge('gits_sessions_attached',
+                       'The number of the terminals with a client.',
+                       lambda: len(sessions) - len(self._detached))
+        registry.gauge('gits_sessions_detached',
+                       'The number of the terminals kept for their clients '
+                       'to reattach.',
+                       lambda: len(self._detached))
+        self.bytes_read = registry.counter(
+            'gits_pty_read_bytes_total',
+            'The number of bytes read from the terminals.')
+        self.bytes_written = registry.counter(
+            'gits_input_written_bytes_total',
+            'The number of bytes of the input written to the terminals.')
+        self.frames_sent = registry.counter(
+            'gits_frames_sent_total',
+            'The number of frames sent to the clients.')
+        self.bytes_sent = registry.counter(
+            'gits_sent_bytes_total',
+            'The number of bytes of the messages sent to the clients.')
+        self.cpu_time = registry.counter(
+            'gits_terminal_cpu_seconds_total',
+            'The CPU time the terminals were charged for.')
+        self.throttled = registry.counter(
+            'gits_throttled_total',
+            'The number of times the terminals exceeded their budgets and '
+            'were throttled.')
+        self.parse_time = registry.histogram(
+            'gits_parse_seconds',
+            'The CPU time spent on parsing a chunk of the output.')
+        self.render_time = registry.histogram(
+            'gits_render_seconds',
+            'The CPU time spent on rendering a frame.')
+        self.loop_lag = registry.histogram(
+            'gits_loop_lag_seconds',
+            'The delay of the callbacks scheduled in the IOLoop.',
+            LAG_BUCKETS)
+
+        self._expected = None
+        self._probe_lag()
+
+    def _probe_lag(self):
+        now = self._io_loop.time()
+        if self._expected is not None:
+            self.loop_lag.observe(max(0.0, now - self._expected))
+
+        self._expected = now + LAG_PROBE_INTERVAL
+        self._io_loop.call_at(self._expected, self._probe_lag)
+
+    def set_detached(self, detached):
+        """Sets the detached sessions counted by the metrics. """
+        self._detached = detached
+
+
 class TermSocketHandler(WebSocketHandler):
     clients = {}
 
+    # Maps the share tokens to the tuples ``(fd, writable)``. The clients
+    # connecting with a share token view the terminal of another client.
+    shares = {}
+
     def __init__(self, application, request, **kwargs):
         WebSocketHandler.__init__(self, application, request, **kwargs)
 
         self._fd = None
         self._io_loop = IOLoop.current()
 
+        # The viewers share the terminal of its owner. The owner reads from
+        # the terminal and renders the frames for all the viewers. The
+        # viewers, which can't write to the terminal, are read-only.
+        self._owner = None
+        self._writable = True
+        self._scheduler = RenderScheduler(self._io_loop, self._render,
+                                          options.max_fps, options.coalesce_ms)
+
+        # When the application has a thread pool, all the work with the
+        # terminal is done there. Reading from the terminal is paused while
+        # too many jobs are queued. The jobs belong to the session, since
+        # the terminal may outlive the client (see DetachedSessions).
+        self._jobs = None
+        self._paused = False
+
+        # Reading from the terminal is also paused while it's throttled, see
+        # FairShare.
+        self._fair_share = application.fair_share
+        self._metrics = application.metrics
+        self._usage = None  # the usage of the session, see _start
+        self._throttled = False
+        self._reading = False
+
+        # The clients, which are too slow to receive what has been sent to
+        # them, are skipped when the frames are sent. Reading from the
+        # terminal is paused while all its clients lag behind. The owner
+        # creates it in _start and the viewers share it, see Backpressure.
+        self._backpressure = None
+
+        # The terminal is chosen by the first message of the client, see
+        # _start.
+        self._started = False
+
+        self._size = None  # the size the terminal is being resized to
+        self._resize_timeout = None
+
+        # The output of the terminal is read into the same buffer each time.
+        self._read_view = memoryview(bytearray(READ_BUFFER_SIZE))
+
     def _create(self, rows=24, cols=80):
-        pid, fd = pty.fork()
-        if pid == 0:
-            if os.getuid() == 0:
-                cmd = ['/bin/login']
-            else:
-                # The prompt has to end with a newline character.
-                sys.stdout.write(socket.gethostname() + ' login: \n')
-                login = sys.stdin.readline().strip()
-
-                cmd = [
-                    'ssh',
-                    '-oPreferredAuthentications=keyboard-interactive,password',
-                    '-oNoHostAuthenticationForLocalhost=yes',
-                    '-oLogLevel=FATAL',
-                    '-F/dev/null',
-                    '-l', login, 'localhost',
-                ]
-
-            env = {
-                'COLUMNS': str(cols),
-                'LINES': str(rows),
-                'PATH': os.environ['PATH'],
-                'TERM': 'linux',
-            }
-            os.execvpe(cmd[0], cmd, env)
+        session = self.application.pool.claim()
+        if session:
+            pid, fd, terminal = session
         else:
-            fcntl.fcntl(fd, fcntl.F_SETFL, os.O_NONBLOCK)
-            fcntl.ioctl(fd, termios.TIOCSWINSZ,
-                        struct.pack('HHHH', rows, cols, 0, 0))
-            TermSocketHandler.clients[fd] = {
-                'client': self,
-                'pid': pid,
-                'terminal': Terminal(rows, cols)
-            }
+            pid, fd = spawn_shell(rows, cols)
+            terminal = Terminal(rows, cols, options.scrollback)
+
+        jobs = None
+        if self.application.executor:
+            jobs = SerialExecutor(self._io_loop, self.application.executor,
+                                  options.max_queued_jobs)
+
+        share = {}
+        if options.share:
+            share = {'read': new_token(), 'write': new_token()}
+            TermSocketHandler.shares[share['read']] = (fd, False)
+            TermSocketHandler.shares[share['write']] = (fd, True)
+
+        token = new_token()
+        recorder = None
+        if options.record_dir:
+            prefix = os.path.join(options.record_dir, '{}-{}'.format(
+                time.strftime('%Y%m%d-%H%M%S'), token[:8]))
+            recorder = Recorder(prefix, rows, cols,
+                                self.application.record_executor,
+                                options.record_input, options.record_compress,
+                                options.record_max_mb * 1024 ** 2)
+
+        TermSocketHandler.clients[fd] = {
+            'client': self,
+            'pid': pid,
+            'terminal': terminal,
+            'jobs': jobs,
+            'token': token,
+            'share': share,
+            'viewers': set(),
+            'recorder': recorder,
+            'usage': Usage(),
+        }
+
+        return fd
+
+    @staticmethod
+    def _destroy(fd):
+        session = TermSocketHandler.clients.pop(fd)
+        kill_shell(session['pid'], fd)
+        if session['recorder']:
+            session['recorder'].close()
+        for token in session['share'].values():
+            del TermSocketHandler.shares[token]
+
+        usage = session['usage']
+        app_log.info('Terminal %d read %d bytes, took %.3f s of CPU time and '
+                     'was throttled %d times', fd, usage.bytes, usage.cpu,
+                     usage.throttled)
+
+    @classmethod
+    def report_usage(cls):
+        """Logs the resources consumed by the terminals so far. """
+        for fd, session in cls.clients.items():
+            usage = session['usage']
+            app_log.info('Terminal %d has read %d bytes, taken %.3f s of CPU '
+                         'time and been throttled %d times so far', fd,
+                         usage.bytes, usage.cpu, usage.throttled)
+
+    def _attached(self):
+        """Checks if the client is still attached to its terminal. """
+        session = TermSocketHandler.clients.get(self._fd)
+        return session is not None and session['client'] is self
+
+    def _viewing(self):
+        """Checks if the viewer still views the terminal. """
+        session = TermSocketHandler.clients.get(self._fd)
+        return session is not None and self in session['viewers']
+
+    def _stop(self):
+        viewers = TermSocketHandler.clients[self._fd]['viewers']
+        while viewers:
+            viewers.pop().close()
+
+        self._scheduler.cancel()
+        self._fair_share.forget(self._resume)
+        if self._resize_timeout:
+            self._io_loop.remove_timeout(self._resize_timeout)
+            self._resize_timeout = None
+        self._io_loop.remove_handler(self._fd)
+
+    def _detach(self):
+        """Stops reading from the terminal and leaves the shell running for
+        the client to reattach to it. See DetachedSessions.
+        """
+        self._stop()
+        TermSocketHandler.clients[self._fd]['client'] = None
+        self.application.detached.detach(self._fd)
+
+    def _hang_up(self):
+        """Stops reading from the terminal and hangs up the shell. The method
+        may be called several times.
+        """
+        if not self._attached():
+            return
+
+        self._stop()
+        self._destroy(self._fd)
+
+    @classmethod
+    def flush_recorders(cls):
+        """Writes the data recorded since the previous call. """
+        for session in cls.clients.values():
+            if session['recorder']:
+                session['recorder'].flush()
+
+    @classmethod
+    def hang_up_all(cls):
+        """Hangs up the shells of all the clients and closes the connections.
+        """
+        for client in list(cls.clients.values()):
+            if client['client']:
+                client['client']._hang_up()
+                client['client'].close()
+
+    def _update_reading(self):
+        reading = not (self._paused or self._throttled or
+                       self._backpressure.paused)
+        if reading != self._reading:
+            self._reading = reading
+            events = self._io_loop.READ if reading else 0
+            self._io_loop.update_handler(self._fd, events)
+
+    def _charge(self, nbytes=0, cpu=0.0):
+        if not self._attached():
+            return
+
+        exceeded = self._fair_share.charge(self._usage, nbytes, cpu)
+        if exceeded and not self._throttled:
+            self._throttled = True
+            self._fair_share.throttle(self._usage, self._resume)
+            self._update_reading()
+
+    def _resume(self):
+        self._throttled = False
+        if self._attached():
+            self._update_reading()
+
+    def _call(self, callback, fn, *args, histogram=None):
+        """Calls ``fn`` with ``args`` and passes the result to ``callback``.
+        The call is made either in the IOLoop or on the thread pool, see
+        SerialExecutor. The terminal is charged for the CPU time spent by
+        the call, which is also observed by ``histogram``, if specified.
+        """
+        def done(timed_result):
+            cpu, result = timed_result
+            self._charge(cpu=cpu)
+            if histogram:
+                histogram.observe(cpu)
+            callback(result)
+
+        if self._jobs:
+            self._jobs.submit(done, timed, fn, *args)
+        else:
+            done(timed(fn, *args))
+
+    def _read(self, *args, **kwargs):
+        """Reads the output of the terminal until there is no more of it,
+        MAX_DRAIN bytes have been read or reading is paused.
+        """
+        session = TermSocketHandler.clients[self._fd]
+        terminal, recorder = session['terminal'], session['recorder']
+        drain = MAX_DRAIN
+        while drain > 0 and self._reading and self._attached():
+            size = self._fair_share.bytes_left(
+                self._usage, min(READ_BUFFER_SIZE, drain))
+            if not size:
+                self._charge()
+                break
+
+            try:
+                n = os.readv(self._fd, [self._read_view[:size]])
+            except BlockingIOError:
+                break
+            except OSError:  # the shell has exited (EIO)
+                n = 0
+            if not n:
+                self._hang_up()
+                self.close()
+                break
 
-            return fd
+            drain -= n
+            self._charge(n)
+            self._metrics.bytes_read.inc(n)
+            if recorder:
+                recorder.output(self._read_view[:n])
 
-    def _destroy(self, fd):
+            # The buffer is reused by the next read, so the jobs running on
+            # the thread pool get a copy of the output.
+            buf = self._read_view[:n]
+            if self._jobs:
+                buf = buf.tobytes()
+            self._call(self._on_feed, terminal.feed, buf,
+                       histogram=self._metrics.parse_time)
+
+            if self._jobs and self._jobs.is_full() and not self._paused:
+                self._paused = True
+                self._update_reading()
+
+    def _on_feed(self, result):
+        if not self._attached():
+            return
+
+        if self._paused and not self._jobs.is_full():
+            self._paused = False
+            self._update_reading()
+
+        self._scheduler.schedule()
+
+    def _send(self, message, binary=False):
+        """Sends ``message`` to the client. Returns False if the client
+        neither owns nor views the terminal anymore.
+        """
+        if not (self._attached() or self._viewing()):
+            return False
+
+        if isinstance(message, dict):
+            message = json_encode(message)
+
+        size = len(message)
+        self._metrics.bytes_sent.inc(size)
+        self._backpressure.queued(self, size)
+        future = self.write_message(message, binary=binary)
+        future.add_done_callback(lambda f: self._on_sent(size))
+        return True
+
+    def _on_sent(self, size):
+        if self._attached() or self._viewing():
+            self._backpressure.sent(self, size)
+
+    def _block(self, blocked):
+        """Pauses reading from the terminal while all its clients lag behind.
+        See Backpressure.
+        """
+        if self._attached():
+            self._update_reading()
+
+    def _resize(self):
+        self._resize_timeout = None
+        rows, cols = self._size
+
+        session = TermSocketHandler.clients[self._fd]
+        self._call(self._on_feed, session['terminal'].resize, rows, cols)
+        if session['recorder']:
+            session['recorder'].resize(rows, cols)
         try:
-            os.kill(TermSocketHandler.clients[fd]['pid'], signal.SIGHUP)
-            os.close(fd)
+            fcntl.ioctl(self._fd, termios.TIOCSWINSZ,
+                        struct.pack('HHHH', rows, cols, 0, 0))
         except OSError:
-            pass
+            self._hang_up()
+
+    def _format(self):
+        if self.selected_subprotocol == CELLS_PROTOCOL:
+            return 'cells'
+        return 'html'
+
+    def _render(self):
+        """Renders the frame once for the owner and all the viewers of the
+        terminal. The clients (including the owner), which lag behind, are
+        skipped and receive the full screen, when they catch up.
+        """
+        session = TermSocketHandler.clients[self._fd]
+        clients = self._backpressure.select()
+        if not clients:
+            return
+
+        formats = {c._format() for c, full in clients if not full}
+        full_formats = {c._format() for c, full in clients if full}
 
-        del TermSocketHandler.clients[fd]
+        self._call(lambda frames: self._broadcast(frames, clients),
+                   render_frames, session['terminal'], formats, full_formats,
+                   histogram=self._metrics.render_time)
+
+    def _broadcast(self, frames, clients):
+        for client, full in clients:
+            if not self._backpressure.deliver(client, full):
+                continue  # it has missed a frame in the meantime
+
+            message = frames.get((client._format(), full))
+            if message is None:
+                continue  # nothing has changed
+
+            if client._send(message, binary=isinstance(message, bytes)):
+                self._metrics.frames_sent.inc()
 
     # Implementing the methods inherited from
     # tornado.websocket.WebSocketHandler
 
-    def open(self):
-        def callback(*args, **kwargs):
-            buf = os.read(self._fd, 65536)
-            client = TermSocketHandler.clients[self._fd]
-            html = client['terminal'].generate_html(buf)
-            client['client'].write_message(html)
+    def select_subprotocol(self, subprotocols):
+        return CELLS_PROTOCOL if CELLS_PROTOCOL in subprotocols else None
+
+    def _view(self, token):
+        """Makes the client a viewer of the terminal shared with ``token``.
+        """
+        fd, writable = TermSocketHandler.shares.get(token, (None, False))
+        owner = TermSocketHandler.clients[fd]['client'] if fd else None
+        if not owner:  # there is no such terminal or it's detached
+            self.close()
+            return
+
+        self._fd = fd
+        self._owner = owner
+        self._writable = writable
+        self._jobs = owner._jobs
+        self._backpressure = owner._backpressure
+
+        TermSocketHandler.clients[fd]['viewers'].add(self)
+        self._backpressure.add(self, stale=True)
+        owner._scheduler.schedule()
+
+    def _start(self, data):
+        """Handles the first message of the client, which is either
+        ``ses,<session token>`` or ``viw,<share token>``. The tokens are not
+        passed in the URL, so they never appear in the access log.
+        """
+        self._started = True
+
+        # The client may view the terminal of another client.
+        if data.startswith('viw,'):
+            self._view(data[4:])
+            return
 
-        self._fd = self._create()
-        self._io_loop.add_handler(self._fd, callback, self._io_loop.READ)
+        if not data.startswith('ses,'):
+            self.close()
+            return
+
+        # The client may reattach to its terminal after reconnecting. The
+        # token is empty when the client starts a new session.
+        token = data[4:]
+        fd = self.application.detached.attach(token) if token else None
+        if fd is None:
+            self._fd = self._create()
+        else:
+            self._fd = fd
+            TermSocketHandler.clients[fd]['client'] = self
+
+        session = TermSocketHandler.clients[self._fd]
+        self._jobs = session['jobs']
+        self._usage = session['usage']
+        self._backpressure = Backpressure(options.send_high_water,
+                                          options.send_low_water,
+                                          self._block,
+                                          self._scheduler.schedule)
+        self._backpressure.add(self)
+        self._io_loop.add_handler(self._fd, self._read, self._io_loop.READ)
+        self._reading = True
+        self._send({'session': session['token'],
+                    'share': session['share'] or None})
+
+        if fd is None:
+            # The shell taken from the pool has already printed the prompt.
+            self._scheduler.schedule()
+        else:
+            # The screen has to be sent in full to the new connection.
+            self._call(self._on_feed, session['terminal'].redraw)
 
     def on_message(self, data):
+        if not self._started:
+            self._start(data)
+            return
+
+        if self._fd is None or (self._owner and not self._viewing()):
+            return
+
+        # The client asks for the screen scrolled back by the specified
+        # number of rows.
+        if data.startswith('hst,'):
+            try:
+                offset = int(data[4:])
+            except ValueError:
+                return
+
+            terminal = TermSocketHandler.clients[self._fd]['terminal']
+            self._call(lambda sb: self._send({'scrollback': sb}),
+                       terminal.generate_scrollback_html, offset)
+            return
+
+        if not self._writable:
+            return
+
+        # The input of the viewers is handled by the owner.
+        owner = self._owner or self
+
+        # The client asks for resizing the terminal to ``rows x cols``.
+        if data.startswith('rsz,'):
+            try:
+                rows, cols = map(int, data[4:].split('x'))
+            except ValueError:
+                return
+
+            if not (0 < rows <= MAX_SIZE and 0 < cols <= MAX_SIZE):
+                return
+
+            owner._size = rows, cols
+            if not owner._resize_timeout:
+                owner._resize_timeout = self._io_loop.call_later(
+                    RESIZE_DELAY, owner._resize)
+            return
+
+        self._fair_share.on_input(owner._usage)
+        data = data.encode('utf8')
+        recorder = TermSocketHandler.clients[self._fd]['recorder']
+        if recorder:
+            recorder.input(data)
+
         try:
-            os.write(self._fd, data.encode('utf8'))
+            os.write(self._fd, data)
         except (IOError, OSError):
-            self._destroy(self._fd)
+            owner._hang_up()
+            return
+
+        self._metrics.bytes_written.inc(len(data))
 
     def on_close(self):
-        self._io_loop.remove_handler(self._fd)
-        self._destroy(self._fd)
+        if self._owner:
+            if self._viewing():
+                TermSocketHandler.clients[self._fd]['viewers'].discard(self)
+                self._backpressure.remove(self)
+        elif self._attached() and self.application.detached.is_enabled():
+            self._detach()
+        else:
+            self._hang_up()
 
 
 class Application(tornado.web.Application):
-    def __init__(self):
+    def __init__(self, expose_metrics=True):
+        self.metrics = ServerMetrics(IOLoop.current(),
+                                     TermSocketHandler.clients)
+
         handlers = [
             (r'/', IndexHandler),
             (r'/termsocket', TermSocketHandler),
             (r'/experimental', ControlPanelHandler),
         ]
+        if expose_metrics:
+            handlers.append((r'/metrics', MetricsHandler,
+                             dict(metrics=self.metrics)))
         settings = dict(
             template_path=options.templates_path,
             static_path=options.static_path,
         )
         tornado.web.Application.__init__(self, handlers, **settings)
 
+        self.executor = None
+        if options.render_threads:
+            self.executor = ThreadPoolExecutor(options.render_threads)
+
+        # The recordings are written by one thread, so the jobs of each
+        # recorder run in the order of submission. See Recorder.
+        self.record_executor = None
+        if options.record_dir:
+            self.record_executor = ThreadPoolExecutor(1)
+            PeriodicCallback(TermSocketHandler.flush_recorders,
+                             options.record_flush_s * 1000).start()
+
+        self.pool = ShellPool(IOLoop.current(), options.pool_size,
+                              options.pool_max_idle,
+                              scrollback=options.scrollback)
+
+        self.fair_share = FairShare(IOLoop.current(), options.tick_ms,
+                                    options.tick_bytes, options.tick_cpu_ms,
+                                    options.interactive_s,
+                                    self.metrics.cpu_time,
+                                    self.metrics.throttled)
+        if options.usage_report_s:
+            PeriodicCallback(TermSocketHandler.report_usage,
+                             options.usage_report_s * 1000).start()
+
+        self.detached = DetachedSessions(IOLoop.current(),
+                                         TermSocketHandler.clients,
+                                         TermSocketHandler._destroy,
+                                         self.fair_share,
+                                         options.detach_grace,
+                                         options.max_detached,
+                                         options.max_detached_mb * 1024 ** 2,
+                                         self.metrics.bytes_read)
+        self.metrics.set_detached(self.detached)
+
 
 def main():
     tornado.options.parse_command_line()
 
-    http_server = tornado.httpserver.HTTPServer(Application())
-    http_server.listen(options.port)
-    IOLoop.instance().start()
+    workers = options.workers or cpu_count()
+    if workers > 1 and (options.detach_grace or options.share):
+        # The connections are distributed between the workers regardless of
+        # the sessions, so a client can't reach the terminal kept by
+        # another worker.
+        app_log.warning('Reattaching and sharing the terminals are turned '
+                        'off, since there are several workers')
+        options.detach_grace = 0
+        options.share = False
+
+    # Each scrape must reach the same worker, since the metrics of the
+    # workers are unrelated. So with several workers, the metrics are
+    # exposed on a port per worker only.
+    if options.metrics and workers > 1 and not options.metrics_port:
+        app_log.warning('The metrics are not exposed, since there are '
+                        'several workers and --metrics_port is not specified')
+
+    # The tables are loaded before forking, so the workers share them.
+    load_sequences(cache_path=options.sequences_cache or None)
+
+    sockets = None
+    index = 0
+    if workers > 1:
+        if not hasattr(socket, 'SO_REUSEPORT'):
+            # The workers share the listening socket.
+            sockets = bind_sockets(options.port)
+        index = supervise(workers)
+
+    if sockets is None:
+        # Each worker has its own socket and the kernel distributes the
+        # connections between them.
+        sockets = bind_sockets(options.port, reuse_port=workers > 1)
+
+    app = Application(expose_metrics=(options.metrics and workers == 1 and
+                                      not options.metrics_port))
+    http_server = tornado.httpserver.HTTPServer(app)
+    http_server.add_sockets(sockets)
+
+    metrics_server = None
+    if options.metrics and options.metrics_port:
+        metrics_server = tornado.httpserver.HTTPServer(tornado.web.Application(
+            [(r'/metrics', MetricsHandler, dict(metrics=app.metrics))]))
+        metrics_server.listen(options.metrics_port + index)
+
+    io_loop = IOLoop.current()
+
+    def shutdown():
+        http_server.stop()
+        if metrics_server:
+            metrics_server.stop()
+        app.pool.close()
+        TermSocketHandler.hang_up_all()
+        app.detached.close()
+        app.fair_share.close()
+        io_loop.call_later(SHUTDOWN_TIMEOUT, io_loop.stop)
+
+    def handle_signal(signum, frame):
+        io_loop.add_callback_from_signal(shutdown)
+
+    signal.signal(signal.SIGTERM, handle_signal)
+    signal.signal(signal.SIGINT, handle_signal)
+
+    io_loop.start()
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,151 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""The corpora of the output of typical programs. The synthetic corpora are
+generated with a fixed seed, so they are the same on every run. The captured
+corpora are the recordings made by the server (see gits.recording).
+"""
+
+import glob
+import os
+import random
+
+from gits.recording import OUTPUT, RecordingReader
+
+WORDS = ['the', 'terminal', 'output', 'of', 'program', 'is', 'parsed', 'by',
+         'gits', 'and', 'rendered', 'into', 'frames', 'sent', 'to', 'client',
+         'escape', 'sequence', 'screen', 'row', 'cell', 'cursor', 'i', 'a']
+
+
+def _words(rnd, length):
+    line = ''
+    while len(line) < length:
+        line += rnd.choice(WORDS) + ' '
+    return line[:length]
+
+
+def cat(rnd, rows, cols):
+    """Plain text, like ``cat`` of a text file. """
+    return _words(rnd, rnd.randint(0, cols)).encode() + b'\r\n'
+
+
+def ls_color(rnd, rows, cols):
+    """The colored columns of file names, like ``ls --color``. """
+    colors = [b'\x1b[0m', b'\x1b[01;34m', b'\x1b[01;32m', b'\x1b[01;36m',
+              b'\x1b[40;33;01m']
+    line = b''
+    width = 0
+    while width + 16 < cols:
+        name = _words(rnd, rnd.randint(3, 14)).strip().replace(' ', '_')
+        line += (rnd.choice(colors) + name.encode() + b'\x1b[0m' +
+                 b' ' * (16 - len(name)))
+        width += 16
+    return line + b'\r\n'
+
+
+def compiler(rnd, rows, cols):
+    """The warnings of a compiler, highlighted with SGR. """
+    line = rnd.randint(1, 999)
+    source = _words(rnd, rnd.randint(10, cols // 2))
+    return ('\x1b[01m\x1b[Kmain.c:{}:5:\x1b[0m\x1b[K '
+            '\x1b[01;35m\x1b[Kwarning: \x1b[0m\x1b[K'
+            'unused variable ‘{}’ [\x1b[01;35m\x1b[K-Wunused-variable'
+            '\x1b[0m\x1b[K]\r\n'
+            '   {} | {}\r\n'
+            '      | \x1b[01;35m\x1b[K^~~~\x1b[0m\x1b[K\r\n').format(
+                line, rnd.choice(WORDS), line, source).encode()
+
+
+def vim(rnd, rows, cols):
+    """The editor redrawing the screen with syntax highlighting and then
+    moving the cursor around, like ``vim``.
+    """
+    colors = ['\x1b[0m', '\x1b[33m', '\x1b[1m\x1b[34m', '\x1b[32m']
+    out = '\x1b[H\x1b[J'
+    for y in range(1, rows):
+        out += '\x1b[{};1H'.format(y)
+        for word in _words(rnd, rnd.randint(0, cols - 1)).split(' '):
+            out += rnd.choice(colors) + word + ' '
+    out += '\x1b[0m\x1b[{};1H\x1b[7m-- INSERT --\x1b[27m'.format(rows)
+
+    for _ in range(rows * 4):
+        y, x = rnd.randint(1, rows - 1), rnd.randint(1, cols)
+        out += '\x1b[{};{}H'.format(y, x) + rnd.choice(WORDS)
+    return out.encode()
+
+
+def htop(rnd, rows, cols):
+    """The meters and the table of processes refreshed in place, like
+    ``htop``.
+    """
+    out = ''
+    for y in range(1, 5):
+        used = rnd.randint(0, cols // 2 - 10)
+        out += ('\x1b[{0};3H{0}\x1b[1m[\x1b[32m'.format(y) + '|' * used +
+                '\x1b[31m' + '|' * 3 + '\x1b[0m' +
+                ' ' * (cols // 2 - 10 - used) + '\x1b[1m]\x1b[0m')
+    for y in range(6, rows):
+        out += ('\x1b[{};1H\x1b[{}'.format(y, rnd.choice(['0m', '30;46m'])) +
+                '{:6d} root      20   0 {:7d}M {:5.1f} '.format(
+                    rnd.randint(1, 99999), rnd.randint(1, 9999),
+                    rnd.random() * 100) +
+                _words(rnd, cols - 40) + '\x1b[0m')
+    return out.encode()
+
+
+def less(rnd, rows, cols):
+    """The pager scrolling the text within the scrolling region above the
+    status line, like ``less``.
+    """
+    out = '\x1b[1;{}r'.format(rows - 1)
+    for _ in range(rows // 2):
+        out += ('\x1b[{};1H\r\n'.format(rows - 1) +
+                _words(rnd, rnd.randint(0, cols)))
+    out += '\x1b[{};1H\x1b[7m:\x1b[27m\x1b[K'.format(rows)
+    return out.encode()
+
+
+SYNTHETIC = {
+    'cat': cat,
+    'ls_color': ls_color,
+    'compiler': compiler,
+    'vim': vim,
+    'htop': htop,
+    'less': less,
+}
+
+
+def generate(name, rows, cols, size, seed=0):
+    """Generates about ``size`` bytes of the synthetic corpus ``name`` for
+    the terminal of the specified size.
+    """
+    rnd = random.Random(seed)
+    chunks = []
+    total = 0
+    while total < size:
+        chunk = SYNTHETIC[name](rnd, rows, cols)
+        chunks.append(chunk)
+        total += len(chunk)
+    return b''.join(chunks)
+
+
+def load_captured(directory):
+    """Loads the output of the sessions recorded into ``directory``.
+    Returns a dictionary mapping the names of the recordings to the output.
+    """
+    corpora = {}
+    for path in sorted(glob.glob(os.path.join(directory, '*.gitsrec'))):
+        name = os.path.basename(path)[:-len('.gitsrec')]
+        corpora[name] = b''.join(data for kind, _, data in
+                                 RecordingReader(path).records()
+                                 if kind == OUTPUT)
+    return corpora
@@ -0,0 +1,73 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Measures the time it takes to render a frame of the full screen.
+
+Usage: python3 -m gits.benchmark.render [--frames N]
+"""
+
+import argparse
+import random
+import time
+
+from gits.terminal import Terminal
+
+SIZES = [(24, 80), (60, 200), (120, 400)]
+
+SGR = [b'\x1b[0m', b'\x1b[1m', b'\x1b[4m', b'\x1b[7m', b'\x1b[31m',
+       b'\x1b[32m', b'\x1b[44m', b'\x1b[0;10m']
+
+
+def fill_screen(terminal, rows, cols, seed=0):
+    """Fills the screen with colored words, so the rows consist of many
+    spans.
+    """
+    rnd = random.Random(seed)
+    for y in range(rows):
+        line = b''
+        while len(line) < cols:
+            line += rnd.choice(SGR) + b'word' * rnd.randint(1, 3) + b' '
+        terminal.feed('\x1b[{};1H'.format(y + 1).encode() + line)
+
+
+def measure(rows, cols, frames):
+    """Returns the average time (in seconds) of rendering a frame. The rows
+    cache is cleared before each frame, so the rows are rendered from
+    scratch.
+    """
+    terminal = Terminal(rows, cols)
+    fill_screen(terminal, rows, cols)
+
+    total = 0
+    for _ in range(frames):
+        terminal._row_cache.clear()
+        start = time.perf_counter()
+        terminal._build_html()
+        total += time.perf_counter() - start
+
+    return total / frames
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--frames', type=int, default=50,
+                        help='the number of frames to render')
+    args = parser.parse_args()
+
+    for rows, cols in SIZES:
+        seconds = measure(rows, cols, args.frames)
+        print('{:>3}x{:<3} {:8.3f} ms/frame {:8.1f} frames/s'.format(
+            cols, rows, seconds * 1000, 1 / seconds))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,140 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Measures the speed of parsing the output (MB/s of feed) and rendering the
+screen (frames/s of _build_html) for the corpora at several terminal sizes.
+
+Usage: python3 -m gits.benchmark.throughput [--json] [--captured DIR]
+"""
+
+import argparse
+import json
+import platform
+import subprocess
+import sys
+import time
+
+from gits.benchmark import corpora
+from gits.benchmark.render import SIZES
+from gits.terminal import Terminal
+
+# The output is fed in the chunks of the size, like it's read from the
+# pseudo-terminal.
+CHUNK_SIZE = 4096
+
+
+def measure_feed(data, rows, cols, repeat):
+    """Returns the best speed (in bytes per second) of feeding ``data`` to
+    the terminal out of ``repeat`` runs.
+    """
+    chunks = [data[i:i + CHUNK_SIZE] for i in range(0, len(data), CHUNK_SIZE)]
+    best = float('inf')
+    for _ in range(repeat):
+        terminal = Terminal(rows, cols)
+        start = time.perf_counter()
+        for chunk in chunks:
+            terminal.feed(chunk)
+        best = min(best, time.perf_counter() - start)
+
+    return len(data) / best
+
+
+def measure_render(data, rows, cols, frames):
+    """Returns the speed (in frames per second) of rendering the screen
+    left by ``data``. The rows cache is cleared before each frame, so the
+    rows are rendered from scratch.
+    """
+    terminal = Terminal(rows, cols)
+    terminal.feed(data)
+
+    total = 0
+    for _ in range(frames):
+        terminal._row_cache.clear()
+        start = time.perf_counter()
+        terminal._build_html()
+        total += time.perf_counter() - start
+
+    return frames / total
+
+
+def git_revision():
+    """Returns the revision of the working tree or None. """
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(names, captured, size, repeat, frames):
+    """Runs the benchmark for the synthetic corpora ``names`` and the
+    ``captured`` corpora (see corpora.load_captured). Returns the list of
+    the results.
+    """
+    results = []
+    for rows, cols in SIZES:
+        data = [(name, corpora.generate(name, rows, cols, size))
+                for name in names]
+        data += sorted(captured.items())
+        for name, corpus in data:
+            results.append({
+                'corpus': name,
+                'rows': rows,
+                'cols': cols,
+                'bytes': len(corpus),
+                'feed_mb_s': measure_feed(corpus, rows, cols, repeat) / 1e6,
+                'frames_s': measure_render(corpus, rows, cols, frames),
+            })
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--corpus', action='append',
+                        choices=sorted(corpora.SYNTHETIC),
+                        help='the synthetic corpus to measure (all of them '
+                             'by default)')
+    parser.add_argument('--captured', metavar='DIR',
+                        help='the directory with the recordings to measure')
+    parser.add_argument('--size', type=int, default=1024 * 1024,
+                        help='the size of each synthetic corpus in bytes')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='the number of runs of feeding each corpus')
+    parser.add_argument('--frames', type=int, default=20,
+                        help='the number of frames to render')
+    parser.add_argument('--json', action='store_true',
+                        help='print the results in JSON')
+    args = parser.parse_args()
+
+    names = args.corpus or sorted(corpora.SYNTHETIC)
+    captured = corpora.load_captured(args.captured) if args.captured else {}
+    results = run(names, captured, args.size, args.repeat, args.frames)
+
+    if args.json:
+        json.dump({
+            'revision': git_revision(),
+            'python': platform.python_version(),
+            'implementation': platform.python_implementation(),
+            'time': int(time.time()),
+            'results': results,
+        }, sys.stdout, indent=2)
+        print()
+        return
+
+    for r in results:
+        print('{corpus:>12} {cols:>3}x{rows:<3} {feed_mb_s:8.2f} MB/s '
+              '{frames_s:8.1f} frames/s'.format(**r))
+
+
+if __name__ == '__main__':
+    main()
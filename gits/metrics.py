@@ -0,0 +1,141 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Collects the metrics of the server and exposes them in the Prometheus
+text format (see https://prometheus.io/docs/instrumenting/exposition_formats/).
+
+The metrics are updated by the code doing the work, as it goes, and are not
+thread-safe, so they must be updated in one thread (the IOLoop). Exposing
+them costs the same no matter how many sessions there are.
+"""
+
+import bisect
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# The upper bounds (in seconds) of the buckets of the histograms of the time
+# spent on parsing the output and rendering the frames.
+TIME_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025,
+                0.05, 0.1, 0.25, 0.5, 1.0)
+
+
+def _format_value(value):
+    if isinstance(value, float):
+        if value == float('inf'):
+            return '+Inf'
+        return repr(value)
+    return str(value)
+
+
+class Counter:
+    """The value which only grows, such as the number of bytes read. """
+
+    type = 'counter'
+
+    def __init__(self, name, help):
+        self.name = name
+        self.help = help
+        self.value = 0
+
+    def inc(self, amount=1):
+        """Increases the value by ``amount``. """
+        self.value += amount
+
+    def samples(self):
+        """Yields the samples as the pairs ``(name with labels, value)``. """
+        yield self.name, self.value
+
+
+class Gauge:
+    """The value which goes up and down, such as the number of sessions. The
+    value is returned by the ``fn`` function called when the metrics are
+    exposed.
+    """
+
+    type = 'gauge'
+
+    def __init__(self, name, help, fn):
+        self.name = name
+        self.help = help
+        self._fn = fn
+
+    def samples(self):
+        """Yields the samples as the pairs ``(name with labels, value)``. """
+        yield self.name, self._fn()
+
+
+class Histogram:
+    """Counts the observed values, such as durations, in the buckets with
+    the upper bounds ``buckets`` (in ascending order).
+    """
+
+    type = 'histogram'
+
+    def __init__(self, name, help, buckets=TIME_BUCKETS):
+        self.name = name
+        self.help = help
+        self._bounds = tuple(buckets)
+        # The last counter is for the values greater than all the bounds.
+        # The counters are not cumulative, see samples.
+        self._counts = [0] * (len(self._bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        """Adds ``value`` to the histogram. """
+        self._counts[bisect.bisect_left(self._bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def samples(self):
+        """Yields the samples as the pairs ``(name with labels, value)``. """
+        total = 0
+        for bound, count in zip(self._bounds + (float('inf'), ),
+                                self._counts):
+            total += count
+            yield '{}_bucket{{le="{}"}}'.format(
+                self.name, _format_value(float(bound))), total
+        yield self.name + '_sum', self.sum
+        yield self.name + '_count', self.count
+
+
+class Registry:
+    """Keeps the metrics in the order of creation. """
+
+    def __init__(self):
+        self._metrics = []
+
+    def _add(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, help):
+        """Creates a counter. See Counter. """
+        return self._add(Counter(name, help))
+
+    def gauge(self, name, help, fn):
+        """Creates a gauge. See Gauge. """
+        return self._add(Gauge(name, help, fn))
+
+    def histogram(self, name, help, buckets=TIME_BUCKETS):
+        """Creates a histogram. See Histogram. """
+        return self._add(Histogram(name, help, buckets))
+
+    def expose(self):
+        """Returns the metrics in the Prometheus text format. """
+        lines = []
+        for metric in self._metrics:
+            lines.append('# HELP {} {}'.format(metric.name, metric.help))
+            lines.append('# TYPE {} {}'.format(metric.name, metric.type))
+            lines.extend('{} {}'.format(name, _format_value(value))
+                         for name, value in metric.samples())
+        return '\n'.join(lines) + '\n'
@@ -0,0 +1,236 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Records sessions into a compact binary format and reads the recordings.
+
+A recording starts with the header (all the numbers are little-endian):
+* MAGIC (7 bytes);
+* format version (uint8), which is VERSION;
+* flags (uint8), see COMPRESSED;
+* number of rows and columns of the terminal (uint16 each);
+* time the session started, in seconds since the epoch (float64).
+
+The header is followed by the records, compressed with zlib as one stream if
+COMPRESSED is set. Each record consists of its type (uint8, see OUTPUT, INPUT
+and RESIZE), the time since the session started in milliseconds (uint32),
+the length of the data (uint32) and the data itself. The data of RESIZE
+records is the new number of rows and columns (uint16 each).
+
+A recording may be split into several files (see Recorder). Each file starts
+with the header, which has the start time of the session, so the files can
+be read one after another.
+"""
+
+import logging
+import struct
+import time
+import zlib
+
+MAGIC = b'GITSREC'
+VERSION = 1
+
+HEADER = struct.Struct('<7sBBHHd')
+RECORD = struct.Struct('<BII')
+SIZE = struct.Struct('<HH')
+
+# The flags of the header.
+COMPRESSED = 1
+
+# The types of the records.
+OUTPUT = 0
+INPUT = 1
+RESIZE = 2
+
+# Compressing the output is done while the session goes on, so the speed
+# matters more than the ratio (which is still high for terminal output).
+COMPRESSION_LEVEL = zlib.Z_BEST_SPEED
+
+READ_CHUNK_SIZE = 65536
+
+
+class RecordingError(Exception):
+    """Raised when a file is not a recording made by Recorder. """
+
+
+class Recorder:
+    """Records the output of the session (and its input, if
+    ``record_input`` is True) into the files named
+    ``<prefix>.<part>.gitsrec``.
+
+    The records are accumulated in memory and written by flush. If the
+    ``executor`` (such as concurrent.futures.ThreadPoolExecutor with one
+    worker) is specified, compressing and writing is done there, so the
+    caller is never blocked by the disk. The executor must run the jobs in
+    the order of submission.
+
+    When a file grows beyond ``max_bytes`` bytes (0 means no limit), the
+    next part is started.
+    """
+
+    def __init__(self, prefix, rows, cols, executor=None, record_input=False,
+                 compress=True, max_bytes=0):
+        self._prefix = prefix
+        self._rows = rows
+        self._cols = cols
+        self._executor = executor
+        self._record_input = record_input
+        self._compress = compress
+        self._max_bytes = max_bytes
+
+        self._start = time.time()
+        self._pending = []
+        self._closed = False
+
+        # Used only by the jobs writing the records, see _write.
+        self._file = None
+        self._compressor = None
+        self._part = 0
+        self._size = 0
+
+        self._logger = logging.getLogger('tornado.application')
+
+    def _add(self, kind, data):
+        if self._closed:
+            return
+
+        ms = int((time.time() - self._start) * 1000)
+        self._pending.append(RECORD.pack(kind, ms, len(data)))
+        self._pending.append(bytes(data))
+
+    def _open(self):
+        path = '{}.{}.gitsrec'.format(self._prefix, self._part)
+        self._file = open(path, 'wb')
+        self._part += 1
+
+        flags = COMPRESSED if self._compress else 0
+        self._file.write(HEADER.pack(MAGIC, VERSION, flags, self._rows,
+                                     self._cols, self._start))
+        self._size = HEADER.size
+        if self._compress:
+            self._compressor = zlib.compressobj(COMPRESSION_LEVEL)
+
+    def _close_file(self):
+        if self._compressor:
+            self._file.write(self._compressor.flush(zlib.Z_FINISH))
+            self._compressor = None
+        self._file.close()
+        self._file = None
+
+    def _write(self, records, last):
+        try:
+            if records:
+                if self._file is None:
+                    self._open()
+
+                data = b''.join(records)
+                if self._compressor:
+                    data = (self._compressor.compress(data) +
+                            self._compressor.flush(zlib.Z_SYNC_FLUSH))
+                self._file.write(data)
+                self._file.flush()
+                self._size += len(data)
+
+                if self._max_bytes and self._size >= self._max_bytes:
+                    self._close_file()
+
+            if last and self._file:
+                self._close_file()
+        except OSError as e:
+            self._logger.error('Could not write the recording %s: %s',
+                               self._prefix, e)
+
+    def output(self, data):
+        """Records the output of the session. """
+        self._add(OUTPUT, data)
+
+    def input(self, data):
+        """Records the input of the session, if recording the input is
+        enabled.
+        """
+        if self._record_input:
+            self._add(INPUT, data)
+
+    def resize(self, rows, cols):
+        """Records changing the size of the terminal. """
+        self._rows, self._cols = rows, cols
+        self._add(RESIZE, SIZE.pack(rows, cols))
+
+    def flush(self, last=False):
+        """Writes the accumulated records. """
+        records, self._pending = self._pending, []
+        if not records and not last:
+            return
+
+        if self._executor:
+            self._executor.submit(self._write, records, last)
+        else:
+            self._write(records, last)
+
+    def close(self):
+        """Writes the rest of the records and closes the file. """
+        if not self._closed:
+            self.flush(last=True)
+            self._closed = True
+
+
+class RecordingReader:
+    """Reads a file written by Recorder. The header is read when the reader
+    is created and is available as the ``rows``, ``cols`` and ``start``
+    attributes.
+    """
+
+    def __init__(self, path):
+        self._path = path
+        with open(path, 'rb') as f:
+            header = f.read(HEADER.size)
+
+        if len(header) < HEADER.size:
+            raise RecordingError('{} is too short'.format(path))
+
+        magic, version, flags, rows, cols, start = HEADER.unpack(header)
+        if magic != MAGIC or version != VERSION:
+            raise RecordingError('{} is not a recording'.format(path))
+
+        self.compressed = bool(flags & COMPRESSED)
+        self.rows = rows
+        self.cols = cols
+        self.start = start
+
+    def _chunks(self):
+        decompressor = zlib.decompressobj() if self.compressed else None
+        with open(self._path, 'rb') as f:
+            f.seek(HEADER.size)
+            while True:
+                chunk = f.read(READ_CHUNK_SIZE)
+                if not chunk:
+                    return
+
+                yield decompressor.decompress(chunk) if decompressor else chunk
+
+    def records(self):
+        """Yields the records as the tuples ``(type, ms, data)``. The
+        incomplete record at the end of the file (e.g. if the server has
+        been killed) is skipped.
+        """
+        buf = b''
+        pos = 0
+        for chunk in self._chunks():
+            buf = buf[pos:] + chunk
+            pos = 0
+            while len(buf) - pos >= RECORD.size:
+                kind, ms, length = RECORD.unpack_from(buf, pos)
+                end = pos + RECORD.size + length
+                if end > len(buf):
+                    break
+
+                yield kind, ms, buf[pos + RECORD.size:end]
+                pos = end
@@ -0,0 +1,209 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Replays the recordings made by gits.recording.Recorder.
+
+Usage: python3 -m gits.replay [--at MS] [--no-cache] PATH [PATH ...]
+
+Prints the HTML representation of the screen at the specified time (in
+milliseconds since the session started). The files of a recording split
+into several parts must be passed in order.
+"""
+
+import argparse
+import bisect
+import json
+import logging
+import os
+
+from gits.recording import OUTPUT, RESIZE, SIZE, RecordingReader
+from gits.terminal import Terminal
+
+# A keyframe is taken after the recording time or the amount of output
+# since the previous keyframe exceeds the values, so seeking never feeds more
+# than that to the terminal.
+KEYFRAME_MS = 60 * 1000
+KEYFRAME_BYTES = 4 * 1024 * 1024
+
+# The keyframes are stored in the file next to the first part of the
+# recording, so they are built once. The file is invalidated when either the
+# recording or KEYFRAMES_VERSION changes. The file is a line of JSON
+# describing the keyframes followed by the cells of their screens, so
+# reading a file planted next to the recording can't run any code.
+KEYFRAMES_SUFFIX = '.keyframes'
+KEYFRAMES_VERSION = 2
+
+
+class Replay:
+    """Restores the screen of the recorded session at any moment. The parts
+    of the recording are read once to take the keyframes, i.e. the states of
+    the terminal (see Terminal.get_state). Seeking restores the nearest
+    keyframe preceding the moment and feeds only the rest of the output to
+    the terminal, without rendering anything.
+    """
+
+    def __init__(self, paths, keyframe_ms=KEYFRAME_MS,
+                 keyframe_bytes=KEYFRAME_BYTES, cache=True):
+        self._readers = [RecordingReader(path) for path in paths]
+        self._keyframe_ms = keyframe_ms
+        self._keyframe_bytes = keyframe_bytes
+
+        self.rows = self._readers[0].rows
+        self.cols = self._readers[0].cols
+
+        cache_path = paths[0] + KEYFRAMES_SUFFIX if cache else None
+        key = (KEYFRAMES_VERSION, keyframe_ms, keyframe_bytes,
+               tuple((os.stat(p).st_mtime_ns, os.stat(p).st_size)
+                     for p in paths))
+
+        cached = _read_cache(cache_path, key) if cache_path else None
+        if cached is None:
+            cached = self._build_keyframes()
+            if cache_path:
+                _write_cache(cache_path, key, cached)
+
+        # The keyframes are the tuples ``(ms, part, index, state)``, where
+        # ``state`` is the state of the terminal after feeding the records
+        # up to the ``index`` record (exclusively) of the ``part`` file, the
+        # last of which was recorded at ``ms``.
+        self.duration, self._keyframes = cached
+        self._keyframe_times = [keyframe[0] for keyframe in self._keyframes]
+
+    def _records(self, part=0, index=0):
+        """Yields the records as the tuples ``(part, index, type, ms,
+        data)`` starting from the ``index`` record of the ``part`` file.
+        """
+        for part in range(part, len(self._readers)):
+            records = self._readers[part].records()
+            for i, (kind, ms, data) in enumerate(records):
+                if i >= index:
+                    yield part, i, kind, ms, data
+            index = 0
+
+    @staticmethod
+    def _apply(terminal, kind, data):
+        if kind == OUTPUT:
+            terminal.feed(data)
+        elif kind == RESIZE:
+            terminal.resize(*SIZE.unpack(data))
+
+    def _build_keyframes(self):
+        terminal = Terminal(self.rows, self.cols)
+        keyframes = [(-1, 0, 0, terminal.get_state())]
+        last_ms = -1
+        nbytes = 0
+
+        for part, i, kind, ms, data in self._records():
+            if (ms - keyframes[-1][0] >= self._keyframe_ms or
+                    nbytes >= self._keyframe_bytes):
+                keyframes.append((last_ms, part, i, terminal.get_state()))
+                nbytes = 0
+
+            self._apply(terminal, kind, data)
+            nbytes += len(data)
+            last_ms = ms
+
+        return max(last_ms, 0), keyframes
+
+    def seek(self, ms):
+        """Returns the terminal with the screen as it was at ``ms``
+        milliseconds since the session started.
+        """
+        i = bisect.bisect_right(self._keyframe_times, ms) - 1
+        _, part, index, state = self._keyframes[max(i, 0)]
+
+        terminal = Terminal(self.rows, self.cols)
+        terminal.set_state(state)
+        for _, _, kind, record_ms, data in self._records(part, index):
+            if record_ms > ms:
+                break
+            self._apply(terminal, kind, data)
+
+        return terminal
+
+    def render_html(self, ms):
+        """Returns the HTML representation of the screen at ``ms``
+        milliseconds since the session started.
+        """
+        return self.seek(ms).generate_html(b'')
+
+
+def _read_cache(cache_path, key):
+    try:
+        with open(cache_path, 'rb') as f:
+            header = json.loads(f.readline().decode('utf-8'))
+            if header['key'] != json.loads(json.dumps(key)):
+                return None
+
+            keyframes = []
+            for ms, part, index, state in header['keyframes']:
+                screen = f.read(state['screen'])
+                if len(screen) != state['screen']:
+                    return None
+                name, buf, (pending, flags) = state['parser']
+                if name is not None and not name.startswith('_parse_'):
+                    return None
+                state['screen'] = screen
+                state['parser'] = (name, buf, (bytes(pending), flags))
+                keyframes.append((ms, part, index, state))
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+
+    return header['duration'], keyframes
+
+
+def _write_cache(cache_path, key, value):
+    """Stores the keyframes in ``cache_path``. The cache is optional, so the
+    errors are ignored. The file is written under a temporary name and
+    renamed, so a concurrent replay never reads a partial file.
+    """
+    duration, keyframes = value
+    header = {'key': key, 'duration': duration, 'keyframes': []}
+    for ms, part, index, state in keyframes:
+        state = dict(state)
+        state['screen'] = len(state['screen'])
+        name, buf, (pending, flags) = state['parser']
+        state['parser'] = (name, buf, (list(pending), flags))
+        header['keyframes'].append((ms, part, index, state))
+
+    tmp_path = '{}.{}'.format(cache_path, os.getpid())
+    try:
+        with open(tmp_path, 'wb') as f:
+            f.write(json.dumps(header).encode('utf-8') + b'\n')
+            for keyframe in keyframes:
+                f.write(keyframe[3]['screen'])
+        os.replace(tmp_path, cache_path)
+    except OSError:
+        logging.getLogger('tornado.application').debug(
+            'Could not write the keyframes to %s', cache_path)
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('paths', nargs='+', metavar='PATH',
+                        help='the parts of the recording')
+    parser.add_argument('--at', type=int, default=0, metavar='MS',
+                        help='the time (in milliseconds since the session '
+                             'started) of the frame to be rendered')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='neither read nor store the keyframes')
+    args = parser.parse_args()
+
+    replay = Replay(args.paths, cache=not args.no_cache)
+    print(replay.render_html(args.at))
+
+if __name__ == '__main__':
+    main()
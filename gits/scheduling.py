@@ -0,0 +1,344 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Schedules the work of the server with the terminals: rendering the frames,
+running the jobs on the thread pool, sharing the IOLoop between the
+terminals and holding them back while their clients lag behind.
+"""
+
+import collections
+import time
+
+
+# Python 3.7 and later can measure the CPU time of the current thread. The
+# wall-clock time is the closest approximation of it in older versions.
+thread_time = getattr(time, 'thread_time', time.perf_counter)
+
+# The budgets of the interactive terminals are multiplied by the factor.
+INTERACTIVE_FACTOR = 4
+
+
+class RenderScheduler:
+    """Limits the number of frames sent to a client. The output of the
+    program is fed to the terminal as soon as it arrives, but the frame is
+    rendered after the output stops for ``coalesce_ms`` milliseconds, not
+    more often than ``max_fps`` times per second and not later than the
+    frame interval after the first unrendered output.
+    """
+
+    def __init__(self, io_loop, render, max_fps=30, coalesce_ms=5):
+        self._io_loop = io_loop
+        self._render = render
+        self._interval = 1.0 / max_fps if max_fps else 0
+        self._coalesce = coalesce_ms / 1000.0
+
+        self._last_render = 0
+        self._first_pending = None
+        self._timeout = None
+
+    def _flush(self):
+        self._timeout = None
+        self._first_pending = None
+        self._last_render = self._io_loop.time()
+        self._render()
+
+    def schedule(self):
+        """Schedules rendering the latest state of the terminal. """
+        now = self._io_loop.time()
+        if self._first_pending is None:
+            self._first_pending = now
+
+        deadline = min(now + self._coalesce,
+                       self._first_pending + self._interval)
+        deadline = max(deadline, self._last_render + self._interval)
+
+        if self._timeout:
+            self._io_loop.remove_timeout(self._timeout)
+        self._timeout = self._io_loop.call_at(deadline, self._flush)
+
+    def cancel(self):
+        """Cancels the scheduled rendering. """
+        if self._timeout:
+            self._io_loop.remove_timeout(self._timeout)
+            self._timeout = None
+
+
+class SerialExecutor:
+    """Runs the jobs of a terminal on the thread pool ``executor`` one at a
+    time, in the order of submission. The result of each job is passed to its
+    callback in the IOLoop.
+    """
+
+    def __init__(self, io_loop, executor, max_queued):
+        self._io_loop = io_loop
+        self._executor = executor
+        self._max_queued = max_queued
+        self._queue = collections.deque()
+        self._running = False
+
+    def _run_next(self):
+        fn, args, callback = self._queue.popleft()
+        self._running = True
+        future = self._executor.submit(fn, *args)
+        self._io_loop.add_future(future,
+                                 lambda f: self._done(f, callback))
+
+    def _done(self, future, callback):
+        self._running = False
+        if self._queue:
+            self._run_next()
+
+        callback(future.result())
+
+    def is_full(self):
+        """Checks if the number of queued jobs reached the limit. """
+        return len(self._queue) >= self._max_queued
+
+    def submit(self, callback, fn, *args):
+        """Queues the call of ``fn`` with ``args``. """
+        self._queue.append((fn, args, callback))
+        if not self._running:
+            self._run_next()
+
+
+class Backpressure:
+    """Controls the flow of the frames from a terminal to its clients (the
+    owner and the viewers), see TermSocketHandler. The number of bytes
+    queued for sending to each client is tracked. The client, which has
+    ``high_water`` bytes or more queued, lags behind. It's skipped when the
+    frames are sent and becomes stale. The stale client gets the full screen
+    when the number of bytes queued for it drops to ``low_water``.
+
+    Reading from the terminal is paused while all its clients lag behind
+    and resumed when any of them drops to ``low_water``. The ``pause``
+    callback is called with True or False, when reading has to be paused or
+    resumed. The ``render`` callback schedules rendering the frame.
+    """
+
+    def __init__(self, high_water, low_water, pause, render):
+        self._high_water = high_water
+        self._low_water = low_water
+        self._pause = pause
+        self._render = render
+
+        self._unsent = collections.OrderedDict()  # client to bytes queued
+        self._stale = set()
+        self.paused = False
+
+    def _update(self):
+        if self.paused:
+            paused = all(n > self._low_water for n in self._unsent.values())
+        else:
+            paused = all(n >= self._high_water for n in self._unsent.values())
+
+        if paused != self.paused:
+            self.paused = paused
+            self._pause(paused)
+            if not paused:
+                self._render()
+
+    def add(self, client, stale=False):
+        """Adds the client. The stale client gets the full screen in the
+        next frame.
+        """
+        self._unsent[client] = 0
+        if stale:
+            self._stale.add(client)
+        self._update()
+
+    def remove(self, client):
+        """Removes the client. """
+        del self._unsent[client]
+        self._stale.discard(client)
+        self._update()
+
+    def is_lagging(self, client):
+        """Checks if the client is too slow to receive the frames. """
+        return self._unsent[client] >= self._high_water
+
+    def queued(self, client, size):
+        """Counts ``size`` bytes queued for sending to the client. """
+        unsent = self._unsent[client]
+        self._unsent[client] += size
+        if unsent < self._high_water <= self._unsent[client]:
+            self._update()
+
+    def sent(self, client, size):
+        """Counts ``size`` bytes sent to the client. """
+        unsent = self._unsent[client]
+        self._unsent[client] -= size
+        if unsent > self._low_water >= self._unsent[client]:
+            if client in self._stale:
+                self._render()
+            self._update()
+
+    def select(self):
+        """Returns the list of the pairs ``(client, full)`` the next frame
+        is rendered for, where ``full`` tells if the client needs the full
+        screen. The clients, which lag behind, are skipped and become stale.
+        """
+        clients = []
+        for client in self._unsent:
+            if self.is_lagging(client):
+                self._stale.add(client)
+            else:
+                clients.append((client, client in self._stale))
+
+        return clients
+
+    def deliver(self, client, full):
+        """Checks if the frame rendered for the client (see select) has to be
+        sent to it. The client, which has become stale since the frame was
+        rendered, waits for the full screen.
+        """
+        if client not in self._unsent:
+            return False
+
+        if full:
+            self._stale.discard(client)
+            return True
+
+        return client not in self._stale
+
+
+class Usage:
+    """The resources consumed by a terminal, in total and in the current
+    tick.
+    """
+
+    __slots__ = ('bytes', 'cpu', 'throttled', 'last_input',
+                 'tick', 'tick_bytes', 'tick_cpu')
+
+    def __init__(self):
+        self.bytes = 0
+        self.cpu = 0.0
+        self.throttled = 0
+        self.last_input = None
+
+        self.tick = 0
+        self.tick_bytes = 0
+        self.tick_cpu = 0.0
+
+
+class FairShare:
+    """Shares the IOLoop between the terminals. Every ``tick_ms``
+    milliseconds each terminal is given a budget of ``tick_bytes`` bytes of
+    output and ``tick_cpu_ms`` milliseconds of CPU time. A terminal which
+    exceeds its budget is throttled, i.e. its fd is removed from the IOLoop
+    until the next tick. The terminals the user has typed into during the
+    last ``interactive_s`` seconds are interactive and their budgets are
+    several times larger. The CPU time charged and the throttling are
+    counted by the ``cpu`` and ``throttled`` counters, if specified (see
+    gits.metrics.Counter).
+    """
+
+    def __init__(self, io_loop, tick_ms=100, tick_bytes=256 * 1024,
+                 tick_cpu_ms=25, interactive_s=2, cpu=None, throttled=None):
+        self._io_loop = io_loop
+        self._tick_s = tick_ms / 1000.0
+        self._tick_bytes = tick_bytes
+        self._tick_cpu = tick_cpu_ms / 1000.0
+        self._interactive = interactive_s
+        self._cpu = cpu
+        self._throttled_counter = throttled
+
+        # The counters of a terminal are reset when it's charged for the
+        # first time in a tick, so the ticks don't walk all the terminals.
+        self._tick = 1
+        self._throttled = {}  # resume callback to usage
+
+        self._timeout = self._io_loop.call_later(self._tick_s,
+                                                 self._next_tick)
+
+    def _next_tick(self):
+        self._timeout = self._io_loop.call_later(self._tick_s,
+                                                 self._next_tick)
+        self._tick += 1
+
+        throttled, self._throttled = self._throttled, {}
+        for resume in throttled:
+            resume()
+
+    def _factor(self, usage):
+        if (usage.last_input is not None and
+                self._io_loop.time() - usage.last_input < self._interactive):
+            return INTERACTIVE_FACTOR
+
+        return 1
+
+    def _reset(self, usage):
+        if usage.tick != self._tick:
+            usage.tick = self._tick
+            usage.tick_bytes = 0
+            usage.tick_cpu = 0.0
+
+    def on_input(self, usage):
+        """Makes the terminal interactive. """
+        usage.last_input = self._io_loop.time()
+
+    def bytes_left(self, usage, limit):
+        """Returns the number of bytes the terminal may read in the current
+        tick, not more than ``limit``.
+        """
+        if not self._tick_bytes:
+            return limit
+
+        self._reset(usage)
+        left = self._tick_bytes * self._factor(usage) - usage.tick_bytes
+        return max(0, min(left, limit))
+
+    def charge(self, usage, nbytes=0, cpu=0.0):
+        """Charges the terminal for ``nbytes`` bytes of output and ``cpu``
+        seconds of CPU time. Returns True if the terminal exceeded its
+        budget.
+        """
+        self._reset(usage)
+        usage.bytes += nbytes
+        usage.cpu += cpu
+        usage.tick_bytes += nbytes
+        usage.tick_cpu += cpu
+        if self._cpu and cpu:
+            self._cpu.inc(cpu)
+
+        factor = self._factor(usage)
+        return bool(
+            (self._tick_bytes and
+             usage.tick_bytes >= self._tick_bytes * factor) or
+            (self._tick_cpu and usage.tick_cpu >= self._tick_cpu * factor)
+        )
+
+    def throttle(self, usage, resume):
+        """Calls ``resume`` at the beginning of the next tick. """
+        if resume not in self._throttled:
+            usage.throttled += 1
+            self._throttled[resume] = usage
+            if self._throttled_counter:
+                self._throttled_counter.inc()
+
+    def forget(self, resume):
+        """Cancels the call of ``resume``. """
+        self._throttled.pop(resume, None)
+
+    def close(self):
+        """Stops the ticks. The throttled terminals are not resumed. """
+        if self._timeout:
+            self._io_loop.remove_timeout(self._timeout)
+            self._timeout = None
+
+
+def timed(fn, *args):
+    """Calls ``fn`` with ``args`` and returns the CPU time spent by the
+    call along with its result.
+    """
+    start = thread_time()
+    result = fn(*args)
+    return thread_time() - start, result
@@ -0,0 +1,354 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Manages the shells of the sessions: starting them in advance and keeping
+them after their clients have disconnected.
+"""
+
+import binascii
+import collections
+import fcntl
+import os
+import pty
+import signal
+import socket
+import struct
+import sys
+import termios
+
+from gits.scheduling import timed
+from gits.terminal import Terminal
+
+# The size of the buffer the output of a terminal is read into.
+READ_BUFFER_SIZE = 65536
+
+# The interval (in seconds) between the checks for the shells idle for too
+# long in the pool. See ShellPool.
+EXPIRE_INTERVAL = 1
+
+
+def spawn_shell(rows, cols):
+    """Starts the login shell on a new pseudo-terminal of the specified size.
+    Returns the pid of the shell and the fd of the pseudo-terminal.
+    """
+    pid, fd = pty.fork()
+    if pid == 0:
+        if os.getuid() == 0:
+            cmd = ['/bin/login']
+        else:
+            # The prompt has to end with a newline character.
+            sys.stdout.write(socket.gethostname() + ' login: \n')
+            login = sys.stdin.readline().strip()
+
+            cmd = [
+                'ssh',
+                '-oPreferredAuthentications=keyboard-interactive,password',
+                '-oNoHostAuthenticationForLocalhost=yes',
+                '-oLogLevel=FATAL',
+                '-F/dev/null',
+                '-l', login, 'localhost',
+            ]
+
+        env = {
+            'COLUMNS': str(cols),
+            'LINES': str(rows),
+            'PATH': os.environ['PATH'],
+            'TERM': 'linux',
+        }
+        os.execvpe(cmd[0], cmd, env)
+
+    fcntl.fcntl(fd, fcntl.F_SETFL, os.O_NONBLOCK)
+    fcntl.ioctl(fd, termios.TIOCSWINSZ, struct.pack('HHHH', rows, cols, 0, 0))
+
+    return pid, fd
+
+
+def new_token():
+    """Generates a random token identifying a session. """
+    return binascii.hexlify(os.urandom(16)).decode('ascii')
+
+
+def kill_shell(pid, fd):
+    """Hangs up the shell started by spawn_shell. """
+    try:
+        os.kill(pid, signal.SIGHUP)
+        os.close(fd)
+    except OSError:
+        pass
+
+
+class ShellPool:
+    """Keeps ``size`` shells started in advance (see spawn_shell) along with
+    their terminals, so a client claiming one of them doesn't wait for the
+    shell to start. The output of the idle shells (the login prompt) is fed
+    to their terminals. The pool is refilled one shell per IOLoop iteration.
+    The shells which have been idle for longer than ``max_idle`` seconds are
+    replaced, since login gives up waiting for the user eventually.
+    """
+
+    def __init__(self, io_loop, size, max_idle, rows=24, cols=80,
+                 scrollback=0):
+        self._io_loop = io_loop
+        self._size = size
+        self._max_idle = max_idle
+        self._rows = rows
+        self._cols = cols
+        self._scrollback = scrollback
+
+        self._idle = collections.deque()  # from the oldest to the newest
+        self._hung_up = set()  # the pids of the shells to be reaped
+        self._refilling = False
+        self._closed = False
+        self._timeout = None
+
+        if size:
+            self._timeout = self._io_loop.call_later(EXPIRE_INTERVAL,
+                                                     self._expire)
+            self._refill()
+
+    def _refill(self):
+        if (not self._refilling and not self._closed and
+                len(self._idle) < self._size):
+            self._refilling = True
+            self._io_loop.add_callback(self._spawn)
+
+    def _spawn(self):
+        self._refilling = False
+        if self._closed or len(self._idle) >= self._size:
+            return
+
+        pid, fd = spawn_shell(self._rows, self._cols)
+        shell = (pid, fd, Terminal(self._rows, self._cols, self._scrollback),
+                 self._io_loop.time())
+        self._idle.append(shell)
+        self._io_loop.add_handler(fd, lambda fd, events: self._read(shell),
+                                  self._io_loop.READ)
+        self._refill()
+
+    def _read(self, shell):
+        pid, fd, terminal, _ = shell
+        try:
+            buf = os.read(fd, READ_BUFFER_SIZE)
+        except BlockingIOError:
+            return
+        except OSError:
+            buf = b''
+
+        if buf:
+            terminal.feed(buf)
+        else:  # the shell has exited
+            self._remove(shell)
+            self._kill(shell)
+            self._refill()
+
+    def _remove(self, shell):
+        self._idle.remove(shell)
+        self._io_loop.remove_handler(shell[1])
+
+    def _kill(self, shell):
+        kill_shell(shell[0], shell[1])
+        self._hung_up.add(shell[0])
+
+    def _reap(self):
+        for pid in list(self._hung_up):
+            try:
+                reaped, _ = os.waitpid(pid, os.WNOHANG)
+            except ChildProcessError:
+                reaped = pid
+            if reaped:
+                self._hung_up.discard(pid)
+
+    def _expire(self):
+        self._timeout = self._io_loop.call_later(EXPIRE_INTERVAL,
+                                                 self._expire)
+        self._reap()
+        deadline = self._io_loop.time() - self._max_idle
+        while self._idle and self._idle[0][3] < deadline:
+            shell = self._idle[0]
+            self._remove(shell)
+            self._kill(shell)
+
+        self._refill()
+
+    def claim(self):
+        """Takes the oldest idle shell out of the pool. Returns a tuple
+        ``(pid, fd, terminal)`` or None, if the pool is empty.
+        """
+        if not self._idle:
+            return None
+
+        shell = self._idle[0]
+        self._remove(shell)
+        self._refill()
+        return shell[:3]
+
+    def close(self):
+        """Hangs up all the idle shells and stops refilling the pool. """
+        self._closed = True
+        if self._timeout:
+            self._io_loop.remove_timeout(self._timeout)
+            self._timeout = None
+
+        while self._idle:
+            shell = self._idle[0]
+            self._remove(shell)
+            self._kill(shell)
+
+
+class DetachedSessions:
+    """Keeps the terminals, whose clients have disconnected, for ``grace``
+    seconds, so the clients can reattach to them using the session tokens.
+    The output of the detached terminals keeps being fed to them. When there
+    are more than ``max_count`` detached terminals or they take more than
+    ``max_bytes`` bytes (see Terminal.get_max_memory_size), the terminals
+    detached earliest are hung up.
+
+    The ``sessions`` argument is the dictionary mapping the fds of the
+    terminals to the sessions, see TermSocketHandler.clients. The ``destroy``
+    argument is the function hanging up the shell of a session by its fd.
+    Reading from the detached terminals is charged and throttled by
+    ``fair_share`` (see FairShare) like reading from the attached ones.
+    The output read from the detached terminals is counted by the
+    ``bytes_read`` counter, if specified (see gits.metrics.Counter).
+    """
+
+    def __init__(self, io_loop, sessions, destroy, fair_share, grace,
+                 max_count, max_bytes, bytes_read=None):
+        self._io_loop = io_loop
+        self._sessions = sessions
+        self._destroy = destroy
+        self._fair_share = fair_share
+        self._bytes_read = bytes_read
+        self._grace = grace
+        self._max_count = max_count
+        self._max_bytes = max_bytes
+
+        # Maps the tokens to the tuples ``(fd, memory size, timeout, resume
+        # callback)`` in the order of detaching.
+        self._detached = collections.OrderedDict()
+        self._bytes = 0
+
+    def _remove(self, token):
+        fd, size, timeout, resume = self._detached.pop(token)
+        self._bytes -= size
+        self._io_loop.remove_timeout(timeout)
+        self._io_loop.remove_handler(fd)
+        self._fair_share.forget(resume)
+        return fd
+
+    def _hang_up(self, token):
+        self._destroy(self._remove(token))
+
+    def _charge(self, token, usage, nbytes=0, cpu=0.0):
+        """Charges the session and pauses reading from the terminal until
+        the next tick, if the session exceeded its budget. Returns True in
+        this case.
+        """
+        exceeded = self._fair_share.charge(usage, nbytes, cpu)
+        if exceeded and token in self._detached:
+            fd, _, _, resume = self._detached[token]
+            self._io_loop.update_handler(fd, 0)
+            self._fair_share.throttle(usage, resume)
+        return exceeded
+
+    def _on_feed(self, token, usage, timed_result):
+        if not self._charge(token, usage, cpu=timed_result[0]):
+            self._resume(token)
+
+    def _resume(self, token):
+        if token not in self._detached:
+            return
+
+        fd = self._detached[token][0]
+        jobs = self._sessions[fd]['jobs']
+        if not (jobs and jobs.is_full()):
+            self._io_loop.update_handler(fd, self._io_loop.READ)
+
+    def _read(self, token):
+        fd = self._detached[token][0]
+        session = self._sessions[fd]
+        usage = session['usage']
+        size = self._fair_share.bytes_left(usage, READ_BUFFER_SIZE)
+        if not size:
+            self._charge(token, usage)
+            return
+
+        try:
+            buf = os.read(fd, size)
+        except BlockingIOError:
+            return
+        except OSError:
+            buf = b''
+
+        if not buf:  # the shell has exited
+            self._hang_up(token)
+            return
+
+        if self._bytes_read:
+            self._bytes_read.inc(len(buf))
+        if session['recorder']:
+            session['recorder'].output(buf)
+
+        self._charge(token, usage, len(buf))
+        jobs = session['jobs']
+        if jobs:
+            # Reading paused while too many jobs are queued is resumed when
+            # the jobs are done.
+            jobs.submit(lambda result: self._on_feed(token, usage, result),
+                        timed, session['terminal'].feed, buf)
+            if jobs.is_full():
+                self._io_loop.update_handler(fd, 0)
+        else:
+            cpu, _ = timed(session['terminal'].feed, buf)
+            self._charge(token, usage, cpu=cpu)
+
+    def __len__(self):
+        return len(self._detached)
+
+    def is_enabled(self):
+        """Checks if the terminals are kept after their clients have
+        disconnected.
+        """
+        return self._grace > 0 and self._max_count > 0
+
+    def detach(self, fd):
+        """Keeps the terminal ``fd`` for the client to reattach to it. The
+        caller must have removed its own handler of ``fd`` from the IOLoop.
+        """
+        session = self._sessions[fd]
+        token = session['token']
+        size = session['terminal'].get_max_memory_size()
+        timeout = self._io_loop.call_later(self._grace, self._hang_up, token)
+
+        self._detached[token] = (fd, size, timeout,
+                                 lambda: self._resume(token))
+        self._bytes += size
+        self._io_loop.add_handler(fd, lambda fd, events: self._read(token),
+                                  self._io_loop.READ)
+
+        while (len(self._detached) > self._max_count or
+               self._bytes > self._max_bytes):
+            self._hang_up(next(iter(self._detached)))
+
+    def attach(self, token):
+        """Takes the terminal detached with the session token ``token`` back.
+        Returns its fd or None, if there is no such terminal.
+        """
+        if token not in self._detached:
+            return None
+
+        return self._remove(token)
+
+    def close(self):
+        """Hangs up all the detached terminals. """
+        while self._detached:
+            self._hang_up(next(iter(self._detached)))
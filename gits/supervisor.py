@@ -0,0 +1,86 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Runs the server in several worker processes supervised by the parent
+process.
+"""
+
+import os
+import signal
+import sys
+import time
+
+from tornado.log import app_log
+
+# If a worker dies earlier than the time (in seconds) after it has been
+# started, the supervisor waits for the time before restarting it.
+RESTART_DELAY = 1
+
+
+def supervise(number):
+    """Forks ``number`` worker processes and returns the index of the worker
+    (from 0 to ``number`` - 1) in each of them. The parent process never
+    returns. It restarts the workers which die (the restarted worker gets
+    the index of the dead one) and, when it receives SIGTERM or SIGINT,
+    forwards the signal to the workers and exits after all of them have
+    exited.
+    """
+    workers = {}  # pid to the pair (index, start time)
+    stopping = False
+
+    def spawn(index):
+        pid = os.fork()
+        if pid == 0:
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            return True
+
+        workers[pid] = index, time.monotonic()
+        return False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in workers:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except OSError:
+                pass
+
+    for index in range(number):
+        if spawn(index):
+            return index
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    while workers:
+        try:
+            pid, status = os.waitpid(-1, 0)
+        except InterruptedError:  # Python 3.4 doesn't retry after signals
+            continue
+        except ChildProcessError:
+            break
+
+        worker = workers.pop(pid, None)
+        if worker is None or stopping:
+            continue
+
+        index, started = worker
+        app_log.warning('Worker %d exited with status %d, restarting it',
+                        pid, status)
+        if time.monotonic() - started < RESTART_DELAY:
+            time.sleep(RESTART_DELAY)
+        if spawn(index):
+            return index
+
+    sys.exit(0)
@@ -14,13 +14,19 @@
 # under the License.
 
 import array
-import html
+import codecs
+import collections
+import itertools
 import logging
+import os
+import pickle
 import re
+import struct
+import sys
+import time
+import types
 from os import path
 
-import yaml
-
 MAGIC_NUMBER = 0x10000000000
 # +------------------+--------------------------------------------------------+
 # | character (0-31) | 4-byte value represents a character in UTF-8 encoding. |
@@ -49,9 +55,350 @@ REVERSE_BIT = 33
 BLINK_BIT = 34
 BOLD_BIT = 36
 
+CHARACTER_MASK = 0xFFFFFFFF
+
+# The message types of the binary protocol. See generate_cells_patch.
+CELLS_PATCH = 1
+
+# The flag is set in the attributes of the cell the cursor is on. See
+# _render_row_html.
+CURSOR_FLAG = 1 << 31
+
+# Escapes the characters of a span and replaces both spaces and empty cells
+# with non-breaking spaces.
+HTML_TRANSLATION = str.maketrans({
+    '&': '&amp;',
+    '<': '&lt;',
+    '>': '&gt;',
+    '"': '&quot;',
+    "'": '&#x27;',
+    ' ': '\xa0',
+    '\x00': '\xa0',
+})
+
+# Maps the attributes of cells (i.e. the bits 32 and up) to the CSS classes.
+# See css_classes.
+_css_classes = {}
+
+# The number of rendered rows cached per terminal is the number of rows of
+# the screen multiplied by the value. See _build_row_html.
+ROW_CACHE_FACTOR = 2
+
+# Escape sequences longer than the value are considered broken and discarded.
+MAX_SEQUENCE_LEN = 32
+
+# The runs of printable ASCII characters shorter than the value are decoded
+# along with the surrounding output, since switching between the raw and the
+# decoded output costs more than decoding them. See Terminal.feed.
+MIN_ASCII_RUN = 16
+
+# The offset of the byte holding an ASCII character in a cell. See
+# Terminal._echo_string.
+ASCII_OFFSET = 0 if sys.byteorder == 'little' else 7
+
+# The profile of a terminal keeps the counters for at most the number of
+# distinct unmatched and discarded sequences. See Terminal.start_profiling.
+MAX_PROFILED_SEQUENCES = 256
+
+ESC = '\x1b'
+
+# Matches the numeric parameters of an escape sequence.
+NUMBER_RE = re.compile('[0-9]+')
+# Matches both the %d placeholders and the literal numbers of the escape
+# sequences with parameters from the files, containing the matching rules.
+PLACEHOLDER_RE = re.compile('%d|[0-9]+')
+
+SEQUENCES_PATH = path.join(path.dirname(__file__), 'linux_console.yml')
+
+# The tables compiled from the source file may be stored in a cache file to
+# avoid parsing YAML in every process (see load_sequences). The cache is
+# invalidated when either the source file or CACHE_VERSION changes.
+CACHE_VERSION = 2
+
+# The tables shared by all the Terminal instances. See load_sequences.
+_sequences = None
+
+
+def compile_sequences(sequences):
+    """Turns the matching rules (escape sequence to capability) loaded from
+    linux_console.yml into the tables used by the escape sequences parser.
+
+    Returns a tuple of three dictionaries and two regular expressions:
+    * the control characters map (character code to capability);
+    * the static sequences map (escape sequence to capability);
+    * the sequences with parameters map. Each escape sequence is reduced to
+      a template, in which every number (both a placeholder and a literal
+      one) is replaced with %d, so \\E]133;D;%d becomes \\E]%d;D;%d. The
+      template is mapped to a list of tuples ``(fixed, free, capability)``,
+      where ``fixed`` is a tuple of pairs ``(index, value)`` describing the
+      literal numbers and ``free`` is a tuple of the indices of the numbers
+      to be passed to the capability as arguments;
+    * the expression matching a run of characters which are put on the
+      screen as is;
+    * the similar expression for the raw output, which matches only the
+      runs of at least MIN_ASCII_RUN ASCII characters.
+    """
+    static = {}
+    for k, v in sequences['escape_sequences'].items():
+        # Some rules, such as \E[?25h\E[?0c, consist of several escape
+        # sequences. The parser executes each sequence separately, so the
+        # capability is bound to the first one and the rest are ignored.
+        parts = [ESC + i for i in k.replace('\\E', ESC).split(ESC) if i]
+        static[parts[0]] = v
+        for part in parts[1:]:
+            static.setdefault(part, 'ignore')
+
+    params = {}
+    for k, v in sequences['escape_sequences_re'].items():
+        sequence = k.replace('\\E', ESC)
+        fixed, free = [], []
+        for i, number in enumerate(PLACEHOLDER_RE.findall(sequence)):
+            if number == '%d':
+                free.append(i)
+            else:
+                fixed.append((i, int(number)))
+
+        template = PLACEHOLDER_RE.sub('%d', sequence)
+        params.setdefault(template, []).append(
+            (tuple(fixed), tuple(free), v)
+        )
+
+    control_characters = dict(sequences['control_characters'])
+
+    # Matches a run of characters which are put on the screen as is.
+    special = ''.join(chr(i) for i in control_characters) + ESC
+    printable_re = re.compile('[^{}]+'.format(re.escape(special)))
+    special = special.encode('ascii', errors='ignore')
+    ascii_printable_re = re.compile(
+        b'[^' + re.escape(special) + b'\x80-\xff]' +
+        '{{{},}}'.format(MIN_ASCII_RUN).encode('ascii')
+    )
+
+    return (control_characters, static, params, printable_re,
+            ascii_printable_re)
+
+
+def css_classes(attr):
+    """Returns the CSS classes for the cells with the specified attributes
+    ``attr`` (i.e. the bits 32 and up of the cells). The cursor is rendered
+    as white text on a red background, so if CURSOR_FLAG is set in ``attr``,
+    the colors are replaced.
+
+    The number of distinct attributes is small, so the classes are computed
+    once per process.
+    """
+    classes = _css_classes.get(attr)
+    if classes is not None:
+        return classes
+
+    bg, fg = divmod(attr >> (40 - 32) & 0x7F, 16)
+    modes = attr & 0xFF
+
+    if modes & 1 << (REVERSE_BIT - 32):
+        bg, fg = fg, bg
+
+    if attr & CURSOR_FLAG:
+        bg, fg = 1, 7
+
+    classes = ['b{}'.format(bg), 'f{}'.format(fg)]
+
+    if modes & 1 << (UNDERLINE_BIT - 32):
+        classes.append('underline')
+
+    if modes & 1 << (BLINK_BIT - 32):
+        classes.append('blink')
+
+    if modes & 1 << (BOLD_BIT - 32):
+        classes.append('bold')
+
+    classes = _css_classes[attr] = ' '.join(classes)
+    return classes
+
+
+def _read_sequences_cache(cache_path, key):
+    """Returns the tables stored in ``cache_path`` or None, if the file
+    doesn't exist or is stale.
+    """
+    try:
+        with open(cache_path, 'rb') as f:
+            cached_key, tables = pickle.load(f)
+    except (OSError, EOFError, ValueError, pickle.UnpicklingError):
+        return None
+
+    return tables if cached_key == key else None
+
+
+def _write_sequences_cache(cache_path, key, tables):
+    """Stores ``tables`` in ``cache_path``. The cache is optional, so the
+    errors (such as lack of permissions to write to the directory of the
+    package) are ignored.
+    """
+    tmp_path = '{}.{}'.format(cache_path, os.getpid())
+    try:
+        with open(tmp_path, 'wb') as f:
+            pickle.dump((key, tables), f, pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, cache_path)
+    except OSError:
+        logging.getLogger('tornado.application').debug(
+            'Could not write the cache to %s', cache_path)
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+
+
+def load_sequences(source_path=SEQUENCES_PATH, cache_path=None):
+    """Loads the matching rules (escape sequence to capability) from
+    ``source_path`` and compiles them (see compile_sequences).
+
+    The tables are built once per process and shared by all the Terminal
+    instances, so they are returned as read-only mappings. If ``cache_path``
+    is specified, the compiled tables are also stored there, so the other
+    processes don't have to parse YAML at all. The Terminal instances don't
+    use the cache, so it must be loaded before the first instance is
+    created.
+    """
+    global _sequences
+
+    if _sequences is not None and source_path == SEQUENCES_PATH:
+        return _sequences
+
+    stat = os.stat(source_path)
+    key = (CACHE_VERSION, stat.st_mtime_ns, stat.st_size)
+
+    tables = None
+    if cache_path:
+        tables = _read_sequences_cache(cache_path, key)
+
+    if tables is None:
+        import yaml  # only for parsing the source file
+
+        loader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+        with open(source_path) as f:
+            tables = compile_sequences(yaml.load(f.read(), Loader=loader))
+
+        if cache_path:
+            _write_sequences_cache(cache_path, key, tables)
+
+    control_characters, static, params, printable_re, ascii_re = tables
+    params = {k: tuple(v) for k, v in params.items()}
+    tables = (types.MappingProxyType(control_characters),
+              types.MappingProxyType(static),
+              types.MappingProxyType(params),
+              printable_re,
+              ascii_re)
+
+    if source_path == SEQUENCES_PATH:
+        _sequences = tables
+
+    return tables
+
+
+class Screen:
+    """Stores the cells of the screen in separate rows, addressed through the
+    ``lines`` table, so scrolling moves references to the rows instead of
+    copying the cells.
+
+    The screen can also be addressed as if the cells were stored in a flat
+    array of ``rows * cols`` cells, row by row. The areas which cross the
+    boundaries of rows are split into pieces of the rows.
+    """
+
+    def __init__(self, rows, cols):
+        self.rows = rows
+        self.cols = cols
+        self.blank = array.array('Q', [BLACK_AND_WHITE]) * cols
+        self.lines = [array.array('Q', self.blank) for _ in range(rows)]
+
+    def __len__(self):
+        return self.rows * self.cols
+
+    def __eq__(self, other):
+        if isinstance(other, Screen):
+            return self.lines == other.lines
+        return self.get(0, len(self)) == other
+
+    def __repr__(self):
+        return 'Screen({!r})'.format(self.get(0, len(self)))
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            begin, end, _ = key.indices(len(self))
+            return self.get(begin, end)
+
+        y, x = divmod(key, self.cols)
+        return self.lines[y][x]
+
+    def __setitem__(self, key, value):
+        if isinstance(key, slice):
+            begin, end, _ = key.indices(len(self))
+            if end - begin != len(value):
+                raise ValueError('the screen cannot be resized')
+            self.put(begin, value)
+        else:
+            y, x = divmod(key, self.cols)
+            self.lines[y][x] = value
+
+    def _pieces(self, begin, end):
+        """Splits the area of the flat screen from ``begin`` to ``end``
+        (exclusively) into the pieces of the rows. Yields the tuples
+        ``(row, x1, x2)``.
+        """
+        begin = max(0, begin)
+        end = min(end, len(self))
+        while begin < end:
+            y, x = divmod(begin, self.cols)
+            n = min(self.cols - x, end - begin)
+            yield self.lines[y], x, x + n
+            begin += n
+
+    def get(self, begin, end):
+        """Returns the copy of the cells from ``begin`` to ``end``
+        (exclusively).
+        """
+        r = array.array('Q')
+        for row, x1, x2 in self._pieces(begin, end):
+            r += row[x1:x2]
+        return r
+
+    def put(self, begin, cells):
+        """Puts ``cells`` on the screen starting at ``begin``. """
+        i = 0
+        for row, x1, x2 in self._pieces(begin, begin + len(cells)):
+            row[x1:x2] = cells[i:i + x2 - x1]
+            i += x2 - x1
+
+    def clear(self, begin, end):
+        """Clears the cells from ``begin`` to ``end`` (exclusively). """
+        for row, x1, x2 in self._pieces(begin, end):
+            row[x1:x2] = self.blank[x1:x2]
+
+    def tobytes(self):
+        """Returns the cells as bytes, row by row. """
+        return b''.join(row.tobytes() for row in self.lines)
+
+    def resize(self, rows, cols, first=0):
+        """Changes the size of the screen in place. The rows starting from
+        ``first`` are kept, the cells which don't fit into the new size are
+        dropped and the new cells are blank.
+        """
+        blank = array.array('Q', [BLACK_AND_WHITE]) * cols
+        lines = self.lines[first:first + rows]
+        for row in lines:
+            if len(row) > cols:
+                del row[cols:]
+            elif len(row) < cols:
+                row += blank[len(row):]
+        lines += [array.array('Q', blank) for _ in range(rows - len(lines))]
+
+        self.rows = rows
+        self.cols = cols
+        self.blank = blank
+        self.lines = lines
+
 
 class Terminal:
-    def __init__(self, rows=24, cols=80):
+    def __init__(self, rows=24, cols=80, scrollback=0):
         self._cols = cols
         self._rows = rows
         self._cur_y = None
@@ -86,33 +433,68 @@ class Terminal:
 
         self._logger = logging.getLogger('tornado.application')
 
+        # The escape sequences parser is a state machine (see ECMA-048,
+        # section 5.4). The _state field refers to the method handling the
+        # next character of the escape sequence being parsed or is None, if
+        # there is no such sequence. The sequence itself is accumulated in
+        # _buf until its final character comes.
+        self._state = None
         self._buf = ''
         self._outbuf = ''
 
-        with open(path.join(path.dirname(__file__), 'linux_console.yml')) as f:
-            sequences = yaml.load(f.read())
-
-        self.control_characters = sequences['control_characters']
-
-        self._escape_sequences = {}
-        for k, v in sequences['escape_sequences'].items():
-            self._escape_sequences[k.replace('\\E', '\x1b')] = v
-
-        self._escape_sequences_re = []
-        for k, v in sequences['escape_sequences_re'].items():
-            sequence = k.replace('\\E', '\x1b'). \
-                         replace('[', '\['). \
-                         replace('%d', '([0-9]+)')
-
-            self._escape_sequences_re.append(
-                (re.compile(sequence), v)
-            )
+        # The output is decoded incrementally, so the characters, which are
+        # split between two buffers passed to feed, are decoded correctly.
+        # _undecoded is True while the decoder keeps the beginning of such
+        # a character.
+        self._decoder = codecs.getincrementaldecoder('utf-8')('replace')
+        self._undecoded = False
+
+        # The set of rows which have been changed since the last patch was
+        # built. See generate_patch.
+        self._dirty = set()
+
+        # The cursor position, which was sent to the client with the last
+        # patch. The rows the cursor leaves and enters have to be re-rendered
+        # even if their content has not changed.
+        self._cur_rendered = None
+
+        # The rows which were scrolled off the top of the screen are kept in
+        # a ring of ``scrollback`` rows. _scrollback_start is the index of the
+        # oldest row in the ring. The trailing blank cells of the rows are
+        # not stored. See get_scrollback.
+        self._scrollback = [None] * scrollback
+        self._scrollback_start = 0
+        self._scrollback_len = 0
+
+        # Maps the content of a row and the position of the cursor in the row
+        # to the HTML representation of the row. See _build_row_html.
+        self._row_cache = collections.OrderedDict()
+
+        # The counters of the capabilities and the escape sequences executed
+        # since profiling was started. See start_profiling.
+        self._profile = None
+
+        # The tables are shared by all the instances and must not be
+        # modified. See load_sequences.
+        (self.control_characters,
+         self._escape_sequences,
+         self._escape_sequences_params,
+         self._printable_re,
+         self._ascii_printable_re) = load_sequences()
 
         self._cap_rs1()
 
     #
     # Internal methods.
     #
+    def _mark_dirty(self, begin, end):
+        """Marks the rows which contain the cells from ``begin`` to ``end``
+        (exclusively) as changed. See generate_patch.
+        """
+        if end > begin:
+            last = min((end - 1) // self._cols, self._rows - 1)
+            self._dirty.update(range(begin // self._cols, last + 1))
+
     def _peek(self, left_border, right_border, inclusively=False):
         """Captures and returns a rectangular region of the screen between
         ``left_border`` and ``right_border``.
@@ -127,7 +509,7 @@ class Terminal:
         x2, y2 = right_border
         begin = self._cols * y1 + x1
         end = self._cols * y2 + x2 + (1 if inclusively else 0)
-        return self._screen[begin:end]
+        return self._screen.get(begin, end)
 
     def _poke(self, pos, s):
         """Puts the specified slice ``s`` on the screen staring at the position
@@ -140,7 +522,8 @@ class Terminal:
         """
         x, y = pos
         begin = self._cols * y + x
-        self._screen[begin:begin + len(s)] = s
+        self._screen.put(begin, s)
+        self._mark_dirty(begin, begin + len(s))
 
     def _zero(self, left_border, right_border, inclusively=False):
         """Clears the area from ``left_border`` to ``right_border``.
@@ -153,31 +536,56 @@ class Terminal:
         begin = self._cols * y1 + x1
         end = self._cols * y2 + x2 + (1 if inclusively else 0)
         length = end - begin  # the length of the area which have to be cleared
-        self._screen[begin:end] = array.array('Q', [BLACK_AND_WHITE] * length)
+        self._screen.clear(begin, end)
+        self._mark_dirty(begin, end)
         return length
 
     def _scroll_up(self, y1, y2):
         """Moves the area specified by coordinates 0, ``y1`` and 0, ``y2`` up 1
         row.
+
+        The rows are not copied. The references to them are moved up in the
+        lines table, and the row, which is scrolled off the area, is cleared
+        and reused as the bottom row.
         """
-        area = self._peek((0, y1), (self._right_most, y2), inclusively=True)
-        self._poke((0, y1 - 1), area)  # move the area up 1 row (y1 - 1)
-        self._zero((0, y2), (self._cols, y2))
+        if y2 < y1:
+            self._zero((0, y2), (self._cols, y2))
+            return
+
+        lines = self._screen.lines
+        row = lines[y1 - 1]
+        lines[y1 - 1:y2] = lines[y1:y2 + 1]  # move the area up 1 row
+        row[:] = self._screen.blank
+        lines[y2] = row
+        self._dirty.update(range(y1 - 1, y2 + 1))
 
     def _scroll_down(self, y1, y2):
         """Moves the area specified by coordinates 0, ``y1`` and 0, ``y2`` down
-        1 row.
+        1 row. See _scroll_up.
         """
-        line = self._peek((0, y1), (self._cols, y2 - 1))
-        self._poke((0, y1 + 1), line)
-        self._zero((0, y1), (self._cols, y1))
-
-    def _scroll_right(self, x, y):
+        if y2 <= y1:
+            self._zero((0, y1), (self._cols, y1))
+            return
+
+        lines = self._screen.lines
+        row = lines[y2]
+        lines[y1 + 1:y2 + 1] = lines[y1:y2]  # move the area down 1 row
+        row[:] = self._screen.blank
+        lines[y1] = row
+        self._dirty.update(range(y1, y2 + 1))
+
+    def _scroll_right(self, x, y, n=1):
         """Moves a piece of a row specified by coordinates ``x`` and ``y``
-        right by 1 position.
+        right by ``n`` positions. The cells moved off the row are dropped.
         """
-        self._poke((x + 1, y), self._peek((x, y), (self._cols, y)))
-        self._zero((x, y), (x, y), inclusively=True)
+        n = min(n, self._cols - x)
+        if n <= 0:
+            return
+
+        row = self._screen.lines[y]
+        row[x + n:] = row[x:self._cols - n]
+        row[x:x + n] = self._screen.blank[:n]
+        self._dirty.add(y)
 
     def _cursor_down(self):
         """Moves the cursor down by 1 position. If the cursor reaches the
@@ -187,11 +595,33 @@ class Terminal:
             self._eol = False
             q, r = divmod(self._cur_y + 1, self._bottom_most + 1)
             if q:
+                if self._top_most == 0:
+                    self._save_row(0)
                 self._scroll_up(self._top_most + 1, self._bottom_most)
                 self._cur_y = self._bottom_most
             else:
                 self._cur_y = r
 
+    def _save_row(self, y):
+        """Puts the row ``y`` into the scrollback. If the scrollback is full,
+        the oldest row is dropped.
+        """
+        capacity = len(self._scrollback)
+        if not capacity:
+            return
+
+        row = self._screen.lines[y]
+        end = len(row)
+        while end and row[end - 1] == BLACK_AND_WHITE:
+            end -= 1
+
+        i = (self._scrollback_start + self._scrollback_len) % capacity
+        self._scrollback[i] = row[:end]
+        if self._scrollback_len < capacity:
+            self._scrollback_len += 1
+        else:
+            self._scrollback_start = (self._scrollback_start + 1) % capacity
+
     def _cursor_right(self):
         """Moves the cursor right by 1 position. """
         q, r = divmod(self._cur_x + 1, self._cols)
@@ -209,10 +639,51 @@ class Terminal:
             self._cursor_down()
             self._cur_x = 0
 
-        pos = self._cur_y * self._cols + self._cur_x
-        self._screen[pos] = self._sgr | ord(c)
+        self._screen.lines[self._cur_y][self._cur_x] = self._sgr | ord(c)
+        self._dirty.add(self._cur_y)
         self._cursor_right()
 
+    def _echo_string(self, s):
+        """Puts the specified string ``s`` on the screen. The result is the
+        same as calling _echo for each character of the string, but the string
+        is written row by row, using one slice assignment per row.
+
+        The ``s`` argument may also be ASCII bytes. Then the cells are made
+        by copying the bytes into the copies of the cell with the current
+        attributes, which is cheaper than combining the attributes with each
+        character.
+        """
+        cols = self._cols
+        or_sgr = self._sgr.__or__
+        raw = isinstance(s, bytes)
+        if raw:
+            blank_cell = self._sgr.to_bytes(8, sys.byteorder)
+        begin = 0
+        while begin < len(s):
+            if self._eol:
+                self._cursor_down()
+                self._cur_x = 0
+
+            x = self._cur_x
+            end = begin + cols - x  # the rest of the string fits the row
+            if raw:
+                piece = s[begin:end]
+                cells = bytearray(blank_cell) * len(piece)
+                cells[ASCII_OFFSET::8] = piece
+                chunk = array.array('Q', cells)
+            else:
+                chunk = array.array('Q', map(or_sgr, map(ord, s[begin:end])))
+            self._screen.lines[self._cur_y][x:x + len(chunk)] = chunk
+            self._dirty.add(self._cur_y)
+
+            x += len(chunk)
+            begin = end
+            if x < cols:
+                self._cur_x = x
+            else:
+                self._cur_x = cols - 1
+                self._eol = True
+
     def _exec_method(self, name, args=None):
         """Tries to find the specified method and, in case the try succeeds,
         executes it.
@@ -233,7 +704,7 @@ class Terminal:
             self._logger.fatal('The _cap_{name} and _{name} methods do not '
                                'exist'.format(name=name))
 
-    def _ignore(self):
+    def _ignore(self, *args):
         """Allows ignoring some escape and control sequences. """
         pass
 
@@ -411,7 +882,9 @@ class Terminal:
         capabilities are always used together.
         """
         if self._top_most <= self._cur_y <= self._bottom_most:
-            for _ in range(n):
+            # Deleting more lines than there are below the cursor leaves the
+            # same blank area.
+            for _ in range(min(n, self._bottom_most - self._cur_y + 1)):
                 self._scroll_up(self._cur_y + 1, self._bottom_most)
 
     def _cap_dl1(self):
@@ -456,13 +929,12 @@ class Terminal:
 
     def _cap_ich(self, n):
         """Inserts ``n`` number of blank characters. """
-        for i in range(n):
-            self._scroll_right(self._cur_x + i, self._cur_y)
+        self._scroll_right(self._cur_x, self._cur_y, n)
 
     def _cap_il(self, n):
         """Adds ``n`` number of new blank lines. """
-        for _ in range(n):
-            if self._cur_y < self._bottom_most:
+        if self._cur_y < self._bottom_most:
+            for _ in range(min(n, self._bottom_most - self._cur_y + 1)):
                 self._scroll_down(self._cur_y, self._bottom_most)
 
     def _cap_il1(self):
@@ -538,8 +1010,7 @@ class Terminal:
 
     def _cap_rs1(self):
         """Resets terminal completely to sane modes. """
-        cells_number = self._cols * self._rows
-        self._screen = array.array('Q', [BLACK_AND_WHITE] * cells_number)
+        self._screen = Screen(self._rows, self._cols)
         self._sgr = BLACK_AND_WHITE
         self._cur_x_bak = self._cur_x = 0
         self._cur_y_bak = self._cur_y = 0
@@ -548,9 +1019,13 @@ class Terminal:
         self._bottom_most = self._rows - 1
         self._right_most = self._cols - 1
 
+        self._state = None
         self._buf = ''
         self._outbuf = ''
 
+        self._dirty.update(range(self._rows))
+        self._row_cache.clear()
+
     def _cap_sc(self):
         """Saves the current cursor position. See _cap_rc. """
         self._cur_x_bak = self._cur_x
@@ -601,47 +1076,182 @@ class Terminal:
 
         The ``y`` value starts from 1.
         """
-        self._cur_y = min(self._bottom_most, y - 1)
+        self._cur_y = max(0, min(self._bottom_most, y - 1))
 
     def _cap_hpa(self, x):
         """Sets the horizontal position of the cursor to ``x``. See _cap_vpa.
 
         The ``x`` value starts from 1.
         """
-        self._cur_x = min(self._right_most, x - 1)
+        self._cur_x = max(0, min(self._right_most, x - 1))
         self._eol = False  # it's necessary to reset _eol after preceding echo
 
+    def _parse_escape(self, c):
+        """Handles the character ``c`` following ESC. The character either
+        introduces a control sequence (CSI) or an operating system command
+        (OSC), or is an intermediate or final character of an escape sequence.
+        """
+        if c == ESC:
+            self._buf = c  # start over
+        elif ord(c) in self.control_characters:
+            self._exec_single_character_command(c)
+        elif len(self._buf) >= MAX_SEQUENCE_LEN:
+            self._discard_escape_sequence()
+        else:
+            self._buf += c
+            if c == '[':
+                self._state = self._parse_csi
+            elif c == ']':
+                self._state = self._parse_osc
+            elif not '\x20' <= c <= '\x2f':  # not an intermediate character
+                self._exec_escape_sequence()
+
+    def _parse_csi(self, c):
+        """Handles the character ``c`` of a control sequence. The parameter
+        and intermediate characters are accumulated until the final character
+        (in the range from @ to ~) comes.
+        """
+        if c == ESC:
+            self._buf = c
+            self._state = self._parse_escape
+        elif ord(c) in self.control_characters:
+            # Control characters are executed in the middle of a control
+            # sequence without interrupting it.
+            self._exec_single_character_command(c)
+        elif '\x40' <= c <= '\x7e':
+            self._buf += c
+            self._exec_escape_sequence()
+        elif '\x20' <= c <= '\x3f' and len(self._buf) < MAX_SEQUENCE_LEN:
+            self._buf += c
+        else:
+            self._discard_escape_sequence()
+
+    def _parse_osc(self, c):
+        """Handles the character ``c`` of an operating system command. The
+        command is terminated by either BEL or ST. The Linux console specific
+        commands (ESC ] R and ESC ] P nrrggbb) don't have a terminator.
+        """
+        if c == '\x07' or c == '\x9c':
+            self._exec_escape_sequence()
+        elif c == ESC:  # the beginning of ST (ESC \\) or a new sequence
+            self._exec_escape_sequence()
+            self._buf = c
+            self._state = self._parse_escape
+        elif len(self._buf) < MAX_SEQUENCE_LEN:
+            # Too long commands (such as window titles) are consumed up to
+            # the terminator but can't match any rule anyway.
+            self._buf += c
+            command = self._buf[2:]
+            if command == 'R' or (command[0] == 'P' and len(command) == 8):
+                self._exec_escape_sequence()
+
+    def _discard_escape_sequence(self):
+        """Discards the escape sequence being parsed. """
+        self._state = None
+        self._buf = ''
+
     def _exec_escape_sequence(self):
-        """Matches either static escape sequences (such as \E[1m and \E[0;10m)
-        or escape sequences with parameters (such as \E[%d@ and \E[%d;%dr) to
-        one of the capabilities from the files, containing the matching rules
-        (escape sequence to capability). Then the capabilities are executed.
+        """Matches either static escape sequences (such as \\E[1m and
+        \\E[0;10m) or escape sequences with parameters (such as \\E[%d@ and
+        \\E[%d;%dr) to one of the capabilities from the files, containing the
+        matching rules (escape sequence to capability). Then the capabilities
+        are executed.
+
+        The method is called by the parser when the sequence is complete, so
+        both matches cost a dictionary lookup.
+
+        Returns the kind of the match ('static' or 'params') or None if the
+        sequence doesn't match any rule.
         """
-        method_name = self._escape_sequences.get(self._buf, None)
+        sequence = self._buf
+        self._state = None
+        self._buf = ''
 
-        if len(self._buf) > 32:
-            self._buf = ''
-        elif method_name:  # static sequences
+        method_name = self._escape_sequences.get(sequence, None)
+        if method_name:  # static sequences
             self._exec_method(method_name)
-            self._buf = ''
-        else:  # sequences with params
-            for sequence, capability in self._escape_sequences_re:
-                mo = sequence.match(self._buf)
-                if mo:
-                    args = []
-                    for i in mo.groups():
-                        args.append(int(i))
+            return 'static'
+
+        # sequences with params
+        template = NUMBER_RE.sub('%d', sequence)
+        rules = self._escape_sequences_params.get(template, None)
+        if rules:
+            args = [int(i) for i in NUMBER_RE.findall(sequence)]
+            for fixed, free, capability in rules:
+                if all(args[i] == value for i, value in fixed):
+                    self._exec_method(capability, [args[i] for i in free])
+                    return 'params'
 
-                    self._exec_method(capability, args)
-                    self._buf = ''
+        return None
 
-    def _exec_single_character_command(self):
+    def _exec_single_character_command(self, c):
         """Executes control sequences like 10 (LF, line feed) or 13 (CR,
         carriage return).
         """
-        method_name = self.control_characters[ord(self._buf)]
+        method_name = self.control_characters[ord(c)]
         self._exec_method(method_name)
-        self._buf = ''
+
+    def _build_row_html(self, y):
+        """Transforms the row ``y`` of the internal representation of the
+        screen into the HTML representation.
+
+        Most of the rows don't change between frames, so the rendered rows are
+        cached. The cache is keyed by the content of the row and the position
+        of the cursor in the row, and keeps the most recently used rows.
+        """
+        cursor = None
+        if self._cur_visible and y == self._cur_y:
+            cursor = self._cur_x
+
+        row = self._screen.lines[y]
+        key = (row.tobytes(), cursor)
+        cache = self._row_cache
+
+        r = cache.get(key)
+        if r is None:
+            r = cache[key] = self._render_row_html(row, cursor)
+            if len(cache) > self._rows * ROW_CACHE_FACTOR:
+                cache.popitem(last=False)
+        else:
+            cache.move_to_end(key)
+
+        return r
+
+    def _render_row_html(self, row, cursor):
+        """Transforms the specified ``row`` of the screen into the HTML
+        representation. The ``cursor`` argument is the x position of the
+        cursor or None, if the cursor is not in the row.
+        """
+        attrs = [cell >> 32 for cell in row]
+        if cursor is not None:
+            attrs[cursor] |= CURSOR_FLAG
+
+        chars = ''.join(map(chr, map(CHARACTER_MASK.__and__, row)))
+
+        # If the characteristics of the adjacent cells match, combine them
+        # into a group.
+        r = []
+        span_begin = 0
+        span_classes = None
+        x = 0
+        for attr, cells in itertools.groupby(attrs):
+            classes = _css_classes.get(attr) or css_classes(attr)
+            if classes != span_classes:
+                if x:
+                    r.append('<span class="')
+                    r.append(span_classes)
+                    r.append('">')
+                    r.append(chars[span_begin:x].translate(HTML_TRANSLATION))
+                    r.append('</span>')
+                span_begin, span_classes = x, classes
+            x += len(list(cells))
+
+        r.append('<span class="')
+        r.append(span_classes)
+        r.append('">')
+        r.append(chars[span_begin:].translate(HTML_TRANSLATION))
+        r.append('</span>')
+        return ''.join(r)
 
     def _build_html(self):
         """Transforms the internal representation of the screen into the HTML
@@ -649,81 +1259,459 @@ class Terminal:
         """
         self._clean_bit(REVERSE_BIT)
 
-        rows = self._rows
-        cols = self._cols
-        r = ''
-
-        span = ''  # ready-to-output characters
-        span_classes = []
-        for i in range(rows * cols):
-            cell = self._screen[i]
-            q, c = divmod(cell, MAGIC_NUMBER)
-            bg, fg = divmod(q, 16)
-
-            current_classes = [
-                'b{}'.format(bg),
-                'f{}'.format(fg)
-            ]
-
-            if self._is_bit_set(UNDERLINE_BIT, cell):
-                current_classes.append('underline')
-
-            if self._is_bit_set(REVERSE_BIT, cell):
-                current_classes[0] = 'b{}'.format(fg)
-                current_classes[1] = 'f{}'.format(bg)
+        self._dirty.clear()
+        self._cur_rendered = (self._cur_x, self._cur_y, self._cur_visible)
 
-            if self._is_bit_set(BLINK_BIT, cell):
-                current_classes.append('blink')
+        return '\n'.join(self._build_row_html(y) for y in range(self._rows))
 
-            if self._is_bit_set(BOLD_BIT, cell):
-                current_classes.append('bold')
-
-            if i == self._cur_y * cols + self._cur_x and self._cur_visible:
-                current_classes[0], current_classes[1] = 'b1', 'f7'  # cursor
+    def _get_dirty_rows(self):
+        """Returns the sorted list of the rows which have been changed since
+        the last patch was built, including the rows the cursor left and
+        entered. The rows stay dirty until _mark_clean is called, so they
+        are not lost if building the patch fails.
+        """
+        self._clean_bit(REVERSE_BIT)
 
-            # If the characteristics of the current cell match the
-            # characteristics of the previous cell, combine them into a group.
-            if span_classes != current_classes or i + 1 == rows * cols:
-                if len(span):
-                    classes = ' '.join(span_classes)
-                    # Replace spaces with non-breaking spaces.
-                    ch = html.escape(span.replace(' ', '\xa0'))
-                    r += '<span class="{}">{}</span>'.format(classes, ch)
-                span = ''
-                span_classes = current_classes[:]
+        if (self._cur_x, self._cur_y, self._cur_visible) != self._cur_rendered:
+            if self._cur_rendered is not None:
+                self._dirty.add(self._cur_rendered[1])
+            self._dirty.add(self._cur_y)
 
-            if c == 0:
-                span += ' '
+        return sorted(self._dirty)
 
-            span += chr(c & 0xFFFF)
+    def _mark_clean(self):
+        """Starts tracking changes from scratch once the patch has been built.
+        See _get_dirty_rows.
+        """
+        self._dirty.clear()
+        self._cur_rendered = (self._cur_x, self._cur_y, self._cur_visible)
 
-            if not (i + 1) % cols:
-                span += '\n'
+    def _build_patch(self, rows=None):
+        """Transforms the rows of the screen, which have been changed since
+        the last patch was built (or the specified ``rows``), into the HTML
+        representation. See generate_patch.
+        """
+        if rows is None:
+            patch = self._build_patch(self._get_dirty_rows())
+            self._mark_clean()
+            return patch
+
+        return {
+            'cursor': [self._cur_x, self._cur_y],
+            'rows': {y: self._build_row_html(y) for y in rows},
+        }
+
+    def _build_row_cells(self, y):
+        """Packs the row ``y`` of the screen into the binary representation.
+        See generate_cells_patch.
+        """
+        row = self._screen.lines[y]
+        runs = []
+        for attr, cells in itertools.groupby(row, lambda cell: cell >> 32):
+            cells = [cell & CHARACTER_MASK for cell in cells]
+            s = ''.join(map(chr, cells))
+            if not s.strip('\x00 '):
+                s = ''  # blank cells are run-length encoded
+            data = s.replace('\x00', ' ').encode('utf-8')
+            runs.append(struct.pack('<HBBH', len(cells), attr & 0xFF,
+                                    attr >> 8, len(data)))
+            runs.append(data)
+
+        return struct.pack('<HH', y, len(runs) // 2) + b''.join(runs)
+
+    def _build_cells_patch(self, rows=None):
+        """Packs the rows of the screen, which have been changed since the
+        last patch was built (or the specified ``rows``), into the binary
+        representation. See generate_cells_patch.
+        """
+        if rows is None:
+            patch = self._build_cells_patch(self._get_dirty_rows())
+            self._mark_clean()
+            return patch
 
-        return r
+        rows = [self._build_row_cells(y) for y in rows]
+        header = struct.pack('<BHHBHH', CELLS_PATCH, self._cur_x, self._cur_y,
+                             self._cur_visible, self._cols, len(rows))
+        return header + b''.join(rows)
 
     #
     # User visible methods.
     #
-    def generate_html(self, buf):
+    def _feed_string(self, s):
+        """Splits the decoded output ``s`` into output, escape and control
+        sequences. See feed.
+        """
+        match = self._printable_re.match
+        pos = 0
+        while pos < len(s):
+            if not self._state:
+                # Most of the output is printable text, so put the longest
+                # run of printable characters on the screen at once.
+                mo = match(s, pos)
+                if mo:
+                    self._echo_string(mo.group())
+                    pos = mo.end()
+                    continue
+
+            i = s[pos]
+            pos += 1
+            if self._state:
+                self._state(i)
+            elif i == ESC:
+                self._buf = i
+                self._state = self._parse_escape
+            else:
+                self._exec_single_character_command(i)
+
+    def feed(self, buf):
         """Splits ``buf`` into output, escape and control sequences. The output
         prints on the screen as is. The escape and control sequences are
-        executed, affecting the output. Finally, the routine generates the HTML
-        document which is ready to be printed in a user's browser.
+        executed, affecting the output.
 
-        The ``buf`` argument is a byte buffer taken from a terminal-oriented
-        program.
+        The ``buf`` argument is a bytes-like object (e.g. a memoryview of
+        a reused buffer) taken from a terminal-oriented program. The
+        incomplete UTF-8 sequence at the end of ``buf`` is completed by the
+        next call.
         """
-        for i in buf.decode('utf8', errors='replace'):
-            if ord(i) in self.control_characters:
-                self._buf = i
-                self._exec_single_character_command()
-            elif i == '\x1b':
-                self._buf += i
-            elif len(self._buf):
-                self._buf += i
-                self._exec_escape_sequence()
-            else:
-                self._echo(i)
+        # The runs of printable ASCII characters are put on the screen
+        # straight from ``buf``. The rest of the output is decoded up to the
+        # next such run (or a bit further while an escape sequence is being
+        # parsed, since the run may belong to the sequence).
+        match = self._ascii_printable_re.match
+        search = self._ascii_printable_re.search
+        pos = 0
+        while pos < len(buf):
+            ground = not (self._state or self._undecoded)
+            if ground:
+                mo = match(buf, pos)
+                if mo:
+                    self._echo_string(mo.group())
+                    pos = mo.end()
+                    continue
 
+            mo = search(buf, pos + (1 if ground else MAX_SEQUENCE_LEN))
+            end = mo.start() if mo else len(buf)
+            self._feed_string(self._decoder.decode(buf[pos:end]))
+            self._undecoded = bool(self._decoder.getstate()[0])
+            pos = end
+
+    def generate_html(self, buf):
+        """Feeds ``buf`` to the terminal (see feed) and generates the HTML
+        document, representing the whole screen, which is ready to be printed
+        in a user's browser.
+        """
+        self.feed(buf)
         return self._build_html()
+
+    def get_scrollback_size(self):
+        """Returns the number of rows in the scrollback. """
+        return self._scrollback_len
+
+    def get_scrollback(self, begin=0, end=None):
+        """Returns the list of the rows of the scrollback from ``begin`` to
+        ``end`` (exclusively). The rows are numbered from the oldest one.
+        Each row is an array of cells without the trailing blank cells.
+        """
+        begin, end, _ = slice(begin, end).indices(self._scrollback_len)
+        capacity = len(self._scrollback)
+        start = self._scrollback_start
+        return [self._scrollback[(start + i) % capacity]
+                for i in range(begin, end)]
+
+    def generate_scrollback_html(self, offset):
+        """Generates the HTML representation of the screen scrolled back by
+        ``offset`` rows, i.e. the last ``offset`` rows of the scrollback
+        followed by the first rows of the screen.
+
+        Returns a dictionary with the following keys:
+        * ``offset`` is the actual offset, which can't exceed the size of the
+          scrollback;
+        * ``size`` is the size of the scrollback;
+        * ``rows`` is the list of the HTML representation of the rows.
+        """
+        size = self._scrollback_len
+        offset = max(0, min(offset, size))
+        cols = self._cols
+
+        rows = []
+        for row in self.get_scrollback(size - offset, size - offset +
+                                       self._rows):
+            row = row[:cols]
+            row.extend([BLACK_AND_WHITE] * (cols - len(row)))
+            rows.append(self._render_row_html(row, None))
+
+        rows.extend(self._build_row_html(y)
+                    for y in range(self._rows - len(rows)))
+
+        return {
+            'offset': offset,
+            'size': size,
+            'rows': rows,
+        }
+
+    def generate_patch(self, buf=b''):
+        """Feeds ``buf`` to the terminal (see feed) and generates a patch
+        containing only the rows which have been changed since the previous
+        patch (or the full screen, if there is no such patch).
+
+        The patch is a dictionary with the following keys:
+        * ``cursor`` is a list of coordinates ``[x, y]`` of the cursor;
+        * ``rows`` is a dictionary mapping the numbers of the changed rows
+          to their HTML representation.
+        """
+        self.feed(buf)
+        return self._build_patch()
+
+    def generate_cells_patch(self, buf=b''):
+        """Feeds ``buf`` to the terminal (see feed) and generates a patch
+        like generate_patch does, but packs the changed rows into a compact
+        binary representation instead of HTML. All the numbers are
+        little-endian.
+
+        The patch starts with the header:
+        * message type (uint8), which is always CELLS_PATCH;
+        * x and y position of the cursor (uint16 each);
+        * cursor visibility (uint8);
+        * number of columns (uint16);
+        * number of rows in the patch (uint16).
+
+        Each row consists of the row number (uint16) and the number of runs
+        (uint16), followed by the runs. A run is a group of adjacent cells
+        with the same attributes:
+        * number of cells (uint16);
+        * emphasis and modes (uint8), i.e. the bits 32-39 of the cells;
+        * colors (uint8), i.e. the bits 40-46 of the cells;
+        * length of the text in bytes (uint16), which is 0 if all the cells
+          are blank;
+        * text in UTF-8.
+        """
+        self.feed(buf)
+        return self._build_cells_patch()
+
+    def generate_patches(self, formats, full=False):
+        """Generates the patches for the same changes in each of ``formats``
+        (``'html'`` for generate_patch and ``'cells'`` for
+        generate_cells_patch), so the screen is rendered once for all the
+        clients using the same format. Returns a dictionary mapping the
+        formats to the patches.
+
+        If ``full`` is True, the patches contain the full screen and the
+        changes keep being tracked for the next patch. Otherwise, if nothing
+        has changed since the last patch, no patches are generated.
+        """
+        rows = list(range(self._rows)) if full else self._get_dirty_rows()
+
+        patches = {}
+        if not rows:
+            return patches
+
+        if 'html' in formats:
+            patches['html'] = self._build_patch(rows)
+        if 'cells' in formats:
+            patches['cells'] = self._build_cells_patch(rows)
+
+        if not full:
+            self._mark_clean()
+        return patches
+
+    def resize(self, rows, cols):
+        """Changes the size of the screen keeping its content. If the screen
+        becomes shorter, the rows below the cursor are dropped first, then
+        the rows above it are moved to the scrollback. The cursor and the
+        scrolling region are clamped to the new size. The next patch contains
+        the full screen.
+        """
+        if rows < 1 or cols < 1:
+            raise ValueError('the screen must have at least one cell')
+
+        if (rows, cols) == (self._rows, self._cols):
+            return
+
+        first = max(0, self._cur_y - rows + 1)
+        for y in range(first):
+            self._save_row(y)
+        self._screen.resize(rows, cols, first)
+
+        full_height = (self._top_most == 0 and
+                       self._bottom_most == self._rows - 1)
+        self._rows = rows
+        self._cols = cols
+
+        self._cur_x = min(self._cur_x, cols - 1)
+        self._cur_y -= first
+        self._cur_x_bak = min(self._cur_x_bak, cols - 1)
+        self._cur_y_bak = max(0, min(self._cur_y_bak - first, rows - 1))
+        self._eol = False
+
+        self._left_most = 0
+        self._right_most = cols - 1
+        if full_height:
+            self._top_most, self._bottom_most = 0, rows - 1
+        else:
+            self._top_most = max(0, min(self._top_most - first, rows - 1))
+            self._bottom_most = max(self._top_most,
+                                    min(self._bottom_most - first, rows - 1))
+
+        self._row_cache.clear()
+        self.redraw()
+
+    def redraw(self):
+        """Makes the next patch contain the full screen, e.g. for a client
+        which has just connected to the terminal.
+        """
+        self._dirty = set(range(self._rows))
+        self._cur_rendered = None
+
+    def get_state(self):
+        """Returns the state of the terminal: the screen, the cursor, the
+        attributes, the scrolling region and the state of the parser. The
+        state consists of the built-in types, so it can be pickled. The
+        scrollback is not included. See set_state.
+        """
+        return {
+            'size': (self._rows, self._cols),
+            'screen': self._screen.tobytes(),
+            'cursor': (self._cur_x, self._cur_y, self._cur_visible,
+                       self._eol),
+            'saved_cursor': (self._cur_x_bak, self._cur_y_bak),
+            'sgr': self._sgr,
+            'region': (self._top_most, self._bottom_most, self._left_most,
+                       self._right_most),
+            'parser': (self._state.__name__ if self._state else None,
+                       self._buf, self._decoder.getstate()),
+        }
+
+    def set_state(self, state):
+        """Restores the state returned by get_state. """
+        self._rows, self._cols = state['size']
+        self._screen = Screen(self._rows, self._cols)
+        cells = array.array('Q')
+        cells.frombytes(state['screen'])
+        self._screen.put(0, cells)
+
+        (self._cur_x, self._cur_y,
+         self._cur_visible, self._eol) = state['cursor']
+        self._cur_x_bak, self._cur_y_bak = state['saved_cursor']
+        self._sgr = state['sgr']
+        (self._top_most, self._bottom_most,
+         self._left_most, self._right_most) = state['region']
+
+        name, self._buf, decoder_state = state['parser']
+        self._state = getattr(self, name) if name else None
+        self._decoder.setstate(decoder_state)
+        self._undecoded = bool(decoder_state[0])
+
+        self._row_cache.clear()
+        self.redraw()
+
+    def get_max_memory_size(self):
+        """Returns the number of bytes the cells of the screen and the
+        scrollback take when the scrollback is full of the rows as wide as
+        the screen. The terminal, which keeps being fed, may grow up to the
+        size.
+        """
+        itemsize = self._screen.blank.itemsize
+        scrollback = len(self._scrollback) * self._cols
+        return (len(self._screen) + scrollback) * itemsize
+
+    def start_profiling(self):
+        """Starts counting the invocations of the capabilities, the control
+        characters and the escape sequences, and the time spent on them. See
+        get_profile.
+
+        The counting methods are installed on the instance, so the terminal,
+        which is not profiled, doesn't pay for profiling at all.
+        """
+        if self._profile is None:
+            self.reset_profile()
+        if '_exec_method' in self.__dict__:
+            return
+
+        cls = type(self)
+        clock = time.perf_counter
+
+        def count(table, key, start):
+            entry = table.get(key)
+            if entry is None:
+                entry = table[key] = [0, 0.0]
+            entry[0] += 1
+            entry[1] += clock() - start
+
+        def count_sequence(table, sequence):
+            if sequence in table or len(table) < MAX_PROFILED_SEQUENCES:
+                table[sequence] = table.get(sequence, 0) + 1
+
+        def exec_method(name, args=None):
+            start = clock()
+            cls._exec_method(self, name, args)
+            count(self._profile['capabilities'], name, start)
+
+        def exec_single_character_command(c):
+            start = clock()
+            cls._exec_single_character_command(self, c)
+            count(self._profile['control_characters'], ord(c), start)
+
+        def exec_escape_sequence():
+            sequence = self._buf
+            start = clock()
+            kind = cls._exec_escape_sequence(self)
+            count(self._profile['sequences'], kind or 'unmatched', start)
+            if kind is None:
+                count_sequence(self._profile['unmatched'], sequence)
+            return kind
+
+        def discard_escape_sequence():
+            sequence = self._buf
+            start = clock()
+            cls._discard_escape_sequence(self)
+            count(self._profile['sequences'], 'discarded', start)
+            count_sequence(self._profile['discarded'], sequence)
+
+        self._exec_method = exec_method
+        self._exec_single_character_command = exec_single_character_command
+        self._exec_escape_sequence = exec_escape_sequence
+        self._discard_escape_sequence = discard_escape_sequence
+
+    def stop_profiling(self):
+        """Stops counting. The counters are kept until reset_profile. """
+        for name in ('_exec_method', '_exec_single_character_command',
+                     '_exec_escape_sequence', '_discard_escape_sequence'):
+            self.__dict__.pop(name, None)
+
+    def reset_profile(self):
+        """Resets the counters to zero. """
+        self._profile = {
+            'capabilities': {},
+            'control_characters': {},
+            'sequences': {},
+            'unmatched': {},
+            'discarded': {},
+        }
+
+    def get_profile(self):
+        """Returns the snapshot of the counters as a dictionary with the
+        following keys:
+        * ``capabilities`` maps the names of the capabilities to the tuples
+          ``(count, seconds)``;
+        * ``control_characters`` maps the codes of the control characters to
+          the tuples ``(count, seconds)``;
+        * ``sequences`` maps the kinds of the escape sequences ('static' and
+          'params' for the sequences matched by the static and the parameter
+          rules, 'unmatched' and 'discarded') to the tuples ``(count,
+          seconds)``;
+        * ``unmatched`` and ``discarded`` map the unmatched and the discarded
+          (broken or too long) sequences to their counts. Only the first
+          MAX_PROFILED_SEQUENCES distinct sequences are counted.
+
+        The time of a sequence or a control character includes the time of
+        the capabilities executed by it. The counters are empty if profiling
+        has never been started.
+        """
+        if self._profile is None:
+            self.reset_profile()
+
+        snapshot = {}
+        for key, table in self._profile.items():
+            snapshot[key] = {k: tuple(v) if isinstance(v, list) else v
+                             for k, v in table.items()}
+        return snapshot
@@ -24,6 +24,7 @@ from gits.terminal import (
     REVERSE_BIT,
     BLINK_BIT,
     BOLD_BIT,
+    Terminal,
 )
 from gits.test.helper import Helper
 
@@ -87,6 +88,27 @@ class TestCapabilities(Helper):
         self.assertEqual(1, term._cur_y)
         self.assertFalse(term._eol)
 
+    def test_echo_string(self):
+        """The terminal should have the possibility to put a string on the
+        screen in the same way as putting it character by character.
+        """
+        term = self._terminal
+        want = Terminal(self._rows, self._cols)
+
+        s = self._get_random_string(self._cols * 3 + 5)
+        for pos in [(0, 0), (self._cols - 3, 5), (7, term._bottom_most)]:
+            for t in (term, want):
+                t._cur_x, t._cur_y = pos
+                t._eol = False
+
+            term._echo_string(s)
+            for c in s:
+                want._echo(c)
+
+            self.assertEqual(want._screen, term._screen)
+            self.assertEqual((want._cur_x, want._cur_y, want._eol),
+                             (term._cur_x, term._cur_y, term._eol))
+
     def test_zero(self):
         """The terminal should have the possibility to clear the area from a
         left border starting at position x1, y1 to a right border starting at
@@ -116,6 +138,22 @@ class TestCapabilities(Helper):
 
         # TODO: add a test case for checking scrolling up the last line.
 
+    def test_scroll_moves_rows(self):
+        """Scrolling should move the rows instead of copying their cells and
+        reuse the row scrolled off as the blank one.
+        """
+        term = self._terminal
+        lines = list(term._screen.lines)
+
+        term._scroll_up(1, term._bottom_most)
+        self.assertEqual(lines[1:] + lines[:1], term._screen.lines)
+
+        term._scroll_down(0, term._bottom_most)
+        self.assertEqual(lines, term._screen.lines)
+
+        blank = array.array('Q', [BLACK_AND_WHITE] * term._cols)
+        self.assertEqual(blank, term._screen.lines[0])
+
     def test_scroll_down(self):
         """The terminal should have the possibility to move an area by
         1 line down.
@@ -486,6 +524,38 @@ class TestCapabilities(Helper):
         want = blank_characters + ['x'] * (self._cols - n)
         self._check_string(want, (0, 0), (term._cols, 0))
 
+    def test_cap_ich_at_right_margin(self):
+        """The characters inserted past the end of a line should be dropped
+        along with the characters they push off the line.
+        """
+        term = self._terminal
+
+        self._put_string(['x'] * self._cols, (0, 0))
+        term.feed('\x1b[1;{}H\x1b[3@'.format(self._cols).encode())
+        want = ['x'] * term._right_most + ['\x00']
+        self._check_string(want, (0, 0), (term._cols, 0))
+
+        term.feed(b'\x1b[1;3H\x1b[100000@y')
+        want = ['x', 'x', 'y'] + ['\x00'] * (term._cols - 3)
+        self._check_string(want, (0, 0), (term._cols, 0))
+
+    def test_cap_il_and_dl_many_lines(self):
+        """Adding or deleting more lines than there are below the cursor
+        should clear the lines from the cursor to the bottom.
+        """
+        term = self._terminal
+
+        for y in range(self._rows):
+            self._put_string(['z'] * self._cols, (0, y))
+            term._eol = False
+
+        for seq in (b'L', b'M'):
+            term.feed(b'\x1b[21;1H\x1b[100000' + seq)
+            want = array.array('Q', [BLACK_AND_WHITE] * self._cols * 4)
+            self.assertEqual(want, term._peek((0, 20), (0, self._rows)))
+            self._check_string(['z'] * self._cols, (0, 19),
+                               (term._cols, 19))
+
     def test_cap_il1(self):
         """The terminal should have the possibility to add a new blank line.
         """
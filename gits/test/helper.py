@@ -14,6 +14,8 @@
 # under the License.
 
 import array
+import heapq
+import itertools
 import random
 import string
 import unittest
@@ -31,6 +33,72 @@ def reset_after_executing(func):
     return wrapper
 
 
+class FakeIOLoop:
+    """Stands in for the IOLoop in the tests of the classes scheduling the
+    work of the server. The time doesn't pass until ``advance`` is called.
+    The handlers and the callbacks are only recorded, the timeouts are run
+    by ``advance``.
+    """
+
+    READ = 1
+
+    def __init__(self):
+        self._now = 1000.0
+        self._timeouts = []
+        self._order = itertools.count()
+        self.callbacks = []
+        self.futures = []
+        self.handlers = {}  # fd to the tuple (handler, events)
+
+    def time(self):
+        return self._now
+
+    def call_at(self, deadline, callback, *args):
+        timeout = [deadline, next(self._order), callback, args]
+        heapq.heappush(self._timeouts, timeout)
+        return timeout
+
+    def call_later(self, delay, callback, *args):
+        return self.call_at(self._now + delay, callback, *args)
+
+    def remove_timeout(self, timeout):
+        timeout[2] = None
+
+    def add_callback(self, callback, *args):
+        self.callbacks.append((callback, args))
+
+    def add_future(self, future, callback):
+        self.futures.append((future, callback))
+
+    def add_handler(self, fd, handler, events):
+        self.handlers[fd] = (handler, events)
+
+    def update_handler(self, fd, events):
+        self.handlers[fd] = (self.handlers[fd][0], events)
+
+    def remove_handler(self, fd):
+        del self.handlers[fd]
+
+    def advance(self, seconds):
+        """Moves the time forward by ``seconds`` running the timeouts which
+        are due by then.
+        """
+        deadline = self._now + seconds
+        while self._timeouts and self._timeouts[0][0] <= deadline:
+            timeout = heapq.heappop(self._timeouts)
+            self._now = max(self._now, timeout[0])
+            if timeout[2]:
+                timeout[2](*timeout[3])
+
+        self._now = deadline
+
+    def pending(self):
+        """Returns the deadlines of the timeouts which haven't been run or
+        removed.
+        """
+        return sorted(t[0] for t in self._timeouts if t[2])
+
+
 class Helper(unittest.TestCase):
     def setUp(self):
         self._rows = 24
@@ -0,0 +1,59 @@
+#!/usr/bin/python3
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import unittest
+
+from gits.metrics import Registry
+
+
+class TestMetrics(unittest.TestCase):
+    def setUp(self):
+        self._registry = Registry()
+
+    def test_counter_and_gauge(self):
+        """The counters and the gauges should be exposed with their help and
+        type in the order of creation.
+        """
+        sessions = [1, 2]
+        counter = self._registry.counter('bytes_total', 'The bytes.')
+        self._registry.gauge('sessions', 'The sessions.',
+                             lambda: len(sessions))
+        counter.inc(10)
+        counter.inc()
+        sessions.append(3)
+
+        self.assertEqual('# HELP bytes_total The bytes.\n'
+                         '# TYPE bytes_total counter\n'
+                         'bytes_total 11\n'
+                         '# HELP sessions The sessions.\n'
+                         '# TYPE sessions gauge\n'
+                         'sessions 3\n', self._registry.expose())
+
+    def test_histogram(self):
+        """The buckets of the histograms should be cumulative and the values
+        equal to the bounds should fall into their buckets.
+        """
+        histogram = self._registry.histogram('time', 'The time.', (0.1, 1))
+        for value in (0.05, 0.1, 0.5, 2.0):
+            histogram.observe(value)
+
+        self.assertEqual('# HELP time The time.\n'
+                         '# TYPE time histogram\n'
+                         'time_bucket{le="0.1"} 2\n'
+                         'time_bucket{le="1.0"} 3\n'
+                         'time_bucket{le="+Inf"} 4\n'
+                         'time_sum 2.65\n'
+                         'time_count 4\n', self._registry.expose())
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,180 @@
+#!/usr/bin/python3
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from gits.terminal import (
+    BLACK_AND_WHITE,
+    SEQUENCES_PATH,
+    UNDERLINE_BIT,
+    Terminal,
+    load_sequences,
+)
+from gits.test.helper import Helper
+
+
+class TestParser(Helper):
+    def test_static_sequence(self):
+        """The parser should execute static escape sequences. """
+        term = self._terminal
+
+        term.feed(b'\x1b[4m')
+        self.assertTrue(term._is_bit_set(UNDERLINE_BIT, term._sgr))
+        self.assertIsNone(term._state)
+
+    def test_sequence_with_params(self):
+        """The parser should pass the numeric parameters of an escape sequence
+        to the capability.
+        """
+        term = self._terminal
+
+        term.feed(b'\x1b[12;34H')
+        self.assertEqual((33, 11), (term._cur_x, term._cur_y))
+
+        term.feed(b'\x1b[3;20r')
+        self.assertEqual((2, 19), (term._top_most, term._bottom_most))
+
+    def test_split_sequence(self):
+        """The parser should handle escape sequences split across several
+        buffers.
+        """
+        term = self._terminal
+
+        term.feed(b'\x1b[1')
+        term.feed(b'2;3')
+        term.feed(b'4H')
+        self.assertEqual((33, 11), (term._cur_x, term._cur_y))
+
+    def test_reused_buffer(self):
+        """The parser should accept a memoryview of a buffer, which is
+        overwritten after the call, and complete the characters split
+        across the calls.
+        """
+        term = self._terminal
+        buf = bytearray('aé'.encode('utf-8'))
+
+        term.feed(memoryview(buf)[:2])
+        buf[:] = b'\xa9kz'
+        term.feed(memoryview(buf))
+        self._check_string('aékz', (0, 0), (4, 0))
+
+    def test_ascii_runs(self):
+        """Long runs of ASCII characters should be put on the screen with the
+        current attributes, just like the rest of the output.
+        """
+        term = self._terminal
+        text = 'x' * 100 + 'ё' + 'y' * 20
+
+        term.feed(b'\x1b[4m' + text.encode('utf-8'))
+        want = Terminal(self._rows, self._cols)
+        want._cap_smul()
+        for c in text:
+            want._echo(c)
+
+        self.assertEqual(want._screen, term._screen)
+        self.assertEqual((want._cur_x, want._cur_y),
+                         (term._cur_x, term._cur_y))
+
+    def test_control_character_inside_sequence(self):
+        """Control characters in the middle of a control sequence should be
+        executed without interrupting the sequence.
+        """
+        term = self._terminal
+
+        term.feed(b'ab\x1b[5\r;7H')
+        self.assertEqual((6, 4), (term._cur_x, term._cur_y))
+
+    def test_osc(self):
+        """Operating system commands should be consumed up to the terminator
+        and must not appear on the screen.
+        """
+        term = self._terminal
+
+        term.feed(b'\x1b]0;a very long window title, longer than 32\x07x')
+        term.feed(b'\x1b]133;D;0\x1b\\y')
+        term.feed(b'\x1b]P0aabbccz')
+        self._check_string('xyz', (0, 0), (3, 0))
+
+    def test_broken_sequence(self):
+        """Too long control sequences should be discarded. """
+        term = self._terminal
+
+        term.feed(b'\x1b[' + b'1;' * 32)
+        self.assertIsNone(term._state)
+        self.assertEqual('', term._buf)
+
+    def test_too_many_intermediate_characters(self):
+        """Escape sequences with too many intermediate characters should be
+        discarded as well.
+        """
+        term = self._terminal
+
+        term.feed(b'\x1b' + b'-' * 200000)
+        self.assertIsNone(term._state)
+        self.assertEqual('', term._buf)
+
+    def test_compound_sequence(self):
+        """The first sequence of a compound rule (such as \\Ec\\E]R) should
+        execute the capability.
+        """
+        term = self._terminal
+
+        term.feed(b'abc\x1bc\x1b]R')
+        self.assertEqual((0, 0), (term._cur_x, term._cur_y))
+        self.assertEqual(BLACK_AND_WHITE, term._screen[0])
+
+    def test_shared_tables(self):
+        """All the terminals should share the same read-only tables. """
+        term = Terminal(self._rows, self._cols)
+
+        self.assertIs(self._terminal._escape_sequences, term._escape_sequences)
+        with self.assertRaises(TypeError):
+            term._escape_sequences['\x1b[1m'] = 'ignore'
+
+    def test_sequences_cache(self):
+        """The compiled tables should be stored in and loaded from the cache
+        file.
+        """
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+
+        source_path = os.path.join(tmp_dir, 'linux_console.yml')
+        cache_path = os.path.join(tmp_dir, 'linux_console.pickle')
+        shutil.copy(SEQUENCES_PATH, source_path)
+
+        want = load_sequences(source_path, cache_path)
+        self.assertTrue(os.path.exists(cache_path))
+
+        got = load_sequences(source_path, cache_path)
+        self.assertIsNot(want, got)
+        self.assertEqual(dict(want[1]), dict(got[1]))
+        self.assertEqual(dict(want[2]), dict(got[2]))
+
+    def test_sequences_cache_disabled(self):
+        """The tables should not be cached unless the cache file is
+        specified.
+        """
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+
+        source_path = os.path.join(tmp_dir, 'linux_console.yml')
+        shutil.copy(SEQUENCES_PATH, source_path)
+
+        load_sequences(source_path)
+        self.assertEqual(['linux_console.yml'], os.listdir(tmp_dir))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,217 @@
+#!/usr/bin/python3
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import struct
+import unittest
+
+from gits.terminal import (
+    CELLS_PATCH,
+    CURSOR_FLAG,
+    ROW_CACHE_FACTOR,
+    css_classes,
+)
+from gits.test.helper import Helper
+
+
+class TestPatch(Helper):
+    def test_first_patch_contains_whole_screen(self):
+        """The first patch should contain all the rows of the screen. """
+        patch = self._terminal.generate_patch()
+
+        self.assertEqual(list(range(self._rows)), sorted(patch['rows']))
+        self.assertEqual([0, 0], patch['cursor'])
+
+    def test_echo_marks_row(self):
+        """Echoing a character should produce a patch containing only the row
+        the character was put on.
+        """
+        term = self._terminal
+        term.generate_patch()
+
+        patch = term.generate_patch(b'a')
+        self.assertEqual([0], list(patch['rows']))
+        self.assertIn('a', patch['rows'][0])
+        self.assertEqual([1, 0], patch['cursor'])
+
+        patch = term.generate_patch()
+        self.assertEqual({}, patch['rows'])
+
+    def test_redraw(self):
+        """The patch following redraw should contain the full screen. """
+        term = self._terminal
+        term.generate_patch(b'abc')
+
+        term.redraw()
+        patch = term.generate_patch()
+        self.assertEqual(list(range(self._rows)), sorted(patch['rows']))
+        self.assertEqual([3, 0], patch['cursor'])
+
+    def test_patches(self):
+        """The patches in different formats should contain the same rows. The
+        full patches should not affect tracking changes.
+        """
+        term = self._terminal
+        term.generate_patch()
+
+        term.feed(b'\x1b[3;1Hab')
+        full = term.generate_patches(['html', 'cells'], full=True)
+        self.assertEqual(self._rows, len(full['html']['rows']))
+
+        patches = term.generate_patches(['html', 'cells'])
+        self.assertEqual([0, 2], sorted(patches['html']['rows']))
+        self.assertEqual(2, struct.unpack_from('<BHHBHH', patches['cells'])[5])
+
+        # Nothing has changed since the last patch.
+        self.assertEqual({}, term.generate_patches(['html', 'cells']))
+
+    def test_zero_cursor_position(self):
+        """The zero positions, which programs often use instead of 1, should
+        move the cursor to the first row and column, so both kinds of patch
+        can be built.
+        """
+        term = self._terminal
+        for seq in (b'\x1b[0;0H', b'\x1b[0d\x1b[0G'):
+            term.generate_patches(['html', 'cells'])
+            term.feed(b'\x1b[5;5H')
+            term.generate_patches(['html', 'cells'])
+
+            term.feed(seq)
+            self.assertEqual((0, 0), (term._cur_x, term._cur_y))
+
+            patches = term.generate_patches(['html', 'cells'])
+            self.assertEqual([0, 0], patches['html']['cursor'])
+            self.assertEqual([0, 4], sorted(patches['html']['rows']))
+            header = struct.unpack_from('<BHHBHH', patches['cells'])
+            self.assertEqual((CELLS_PATCH, 0, 0, True, self._cols, 2), header)
+
+        term.feed(b'\x1b[0;0Ha')
+        self.assertEqual([0], list(term.generate_patch()['rows']))
+        header = struct.unpack_from('<BHHBHH', term.generate_cells_patch(b'b'))
+        self.assertEqual((CELLS_PATCH, 2, 0, True, self._cols, 1), header)
+
+    def test_rows_stay_dirty_if_patch_fails(self):
+        """The changed rows should be sent in the next patch, if building
+        the previous one has failed.
+        """
+        term = self._terminal
+        term.generate_patch()
+
+        term.feed(b'\x1b[3;1Hab')
+        term._cur_x = -1  # breaks packing the header of the binary patch
+        with self.assertRaises(struct.error):
+            term.generate_patches(['html', 'cells'])
+
+        term._cur_x = 2
+        patches = term.generate_patches(['html', 'cells'])
+        self.assertEqual([0, 2], sorted(patches['html']['rows']))
+
+    def test_cursor_movement_marks_rows(self):
+        """Moving the cursor should re-render both the row the cursor left and
+        the row the cursor entered.
+        """
+        term = self._terminal
+        term.generate_patch()
+
+        patch = term.generate_patch(b'\x1b[5;1H')
+        self.assertEqual([0, 4], sorted(patch['rows']))
+
+    def test_scroll_marks_region(self):
+        """Scrolling should mark all the rows of the scrolling region. """
+        term = self._terminal
+        term._cur_y = term._bottom_most
+        term.generate_patch()
+
+        patch = term.generate_patch(b'\n')
+        self.assertEqual(list(range(self._rows)), sorted(patch['rows']))
+
+    def test_html_matches_patch(self):
+        """The full HTML document should consist of the rows which are sent in
+        patches.
+        """
+        term = self._terminal
+        term.feed(b'hello <world>')
+
+        rows = term.generate_patch()['rows']
+        want = '\n'.join(rows[y] for y in range(self._rows))
+        self.assertEqual(want, term._build_html())
+        self.assertIn('&lt;world&gt;', want)
+
+    def test_css_classes(self):
+        """The attributes of cells should be mapped to the CSS classes. """
+        self.assertEqual('b0 f7', css_classes(7 << 8))
+        self.assertEqual('b7 f0 underline bold', css_classes(7 << 8 | 0b10011))
+        self.assertEqual('b1 f7 blink', css_classes(7 << 8 | 0b100 |
+                                                    CURSOR_FLAG))
+
+    def test_row_html(self):
+        """The adjacent cells with the same classes should be combined into
+        a span, and the cursor should have its own span.
+        """
+        term = self._terminal
+        term.feed(b'a <b>\x1b[1mc\r')
+
+        want = ('<span class="b1 f7">a</span>'
+                '<span class="b0 f7">\xa0&lt;b&gt;</span>'
+                '<span class="b0 f15 bold">c</span>'
+                '<span class="b0 f7">' + '\xa0' * (self._cols - 6) + '</span>')
+        self.assertEqual(want, term._build_row_html(0))
+
+    def test_row_cache(self):
+        """The rendered rows should be cached and the cache should be
+        bounded.
+        """
+        term = self._terminal
+        term.feed(b'first row\r\nsecond row')
+
+        first = term._build_html()
+        self.assertIs(term._build_row_html(0), term._build_row_html(0))
+        self.assertEqual(first, term._build_html())
+
+        for i in range(self._rows * ROW_CACHE_FACTOR * 2):
+            term.feed('\r\n{}'.format(i).encode())
+            term._build_html()
+        self.assertEqual(self._rows * ROW_CACHE_FACTOR, len(term._row_cache))
+
+    def test_cells_patch(self):
+        """The binary patch should contain the changed rows split into runs
+        of cells with the same attributes.
+        """
+        term = self._terminal
+        term.generate_cells_patch()
+
+        patch = term.generate_cells_patch(b'ab\x1b[4mc\xc3\xa9')
+        header = struct.unpack_from('<BHHBHH', patch)
+        self.assertEqual((CELLS_PATCH, 4, 0, True, self._cols, 1), header)
+
+        y, run_number = struct.unpack_from('<HH', patch, 10)
+        self.assertEqual((0, 3), (y, run_number))
+
+        offset = 14
+        runs = []
+        for _ in range(run_number):
+            cells, modes, colors, length = struct.unpack_from('<HBBH', patch,
+                                                              offset)
+            offset += 6
+            text = patch[offset:offset + length].decode('utf-8')
+            offset += length
+            runs.append((cells, modes, colors, text))
+
+        self.assertEqual([
+            (2, 0, 7, 'ab'),
+            (2, 1, 7, 'c\xe9'),
+            (self._cols - 4, 0, 7, ''),
+        ], runs)
+        self.assertEqual(len(patch), offset)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,88 @@
+#!/usr/bin/python3
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import unittest
+
+from gits.test.helper import Helper
+
+
+class TestProfile(Helper):
+    def _counts(self, table):
+        return {key: count for key, (count, _) in table.items()}
+
+    def test_disabled(self):
+        """The terminal should count nothing unless profiling is started. """
+        term = self._terminal
+        term.feed(b'\x1b[H\x1b[5dtext\r\n')
+
+        profile = term.get_profile()
+        self.assertEqual({}, profile['capabilities'])
+        self.assertEqual({}, profile['sequences'])
+
+    def test_counters(self):
+        """The capabilities, the control characters and the kinds of the
+        sequences should be counted.
+        """
+        term = self._terminal
+        term.start_profiling()
+        term.feed(b'\x1b[H\x1b[H\x1b[5dtext\r\n\x1b[999z')
+
+        profile = term.get_profile()
+        capabilities = self._counts(profile['capabilities'])
+        self.assertEqual(2, capabilities['home'])
+        self.assertEqual(1, capabilities['vpa'])
+        self.assertEqual(1, capabilities['cr'])
+        self.assertEqual(1, capabilities['ind'])
+
+        self.assertEqual({10: 1, 13: 1},
+                         self._counts(profile['control_characters']))
+        self.assertEqual({'static': 2, 'params': 1, 'unmatched': 1},
+                         self._counts(profile['sequences']))
+        self.assertEqual({'\x1b[999z': 1}, profile['unmatched'])
+
+        for _, seconds in profile['capabilities'].values():
+            self.assertGreaterEqual(seconds, 0)
+
+    def test_discarded(self):
+        """The broken and too long sequences should be counted as
+        discarded.
+        """
+        term = self._terminal
+        term.start_profiling()
+        term.feed(b'\x1b[1\x80\x1b[' + b'1;' * 20 + b'H')
+
+        profile = term.get_profile()
+        self.assertEqual(2, profile['sequences']['discarded'][0])
+        self.assertEqual(['\x1b[1', '\x1b[' + '1;' * 15],
+                         sorted(profile['discarded']))
+
+    def test_stop_and_reset(self):
+        """Stopping should keep the counters and resetting should clear
+        them.
+        """
+        term = self._terminal
+        term.start_profiling()
+        term.start_profiling()
+        term.feed(b'\x1b[H')
+        term.stop_profiling()
+        term.feed(b'\x1b[H')
+
+        profile = term.get_profile()
+        self.assertEqual({'home': 1}, self._counts(profile['capabilities']))
+        self.assertNotIn('_exec_method', term.__dict__)
+
+        term.reset_profile()
+        self.assertEqual({}, term.get_profile()['capabilities'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,124 @@
+#!/usr/bin/python3
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import glob
+import os
+import shutil
+import tempfile
+import unittest
+
+from gits.recording import (
+    INPUT,
+    OUTPUT,
+    RESIZE,
+    Recorder,
+    RecordingError,
+    RecordingReader,
+)
+
+
+class TestRecording(unittest.TestCase):
+    def setUp(self):
+        self._dir = tempfile.mkdtemp()
+        self._prefix = os.path.join(self._dir, 'session')
+
+    def tearDown(self):
+        shutil.rmtree(self._dir)
+
+    def _parts(self):
+        return sorted(glob.glob(self._prefix + '.*.gitsrec'),
+                      key=lambda p: int(p.split('.')[-2]))
+
+    def _records(self, path):
+        return [(kind, data)
+                for kind, _, data in RecordingReader(path).records()]
+
+    def _check_round_trip(self, compress):
+        recorder = Recorder(self._prefix, 24, 80, compress=compress)
+        recorder.output(b'login: ')
+        recorder.input(b'root')
+        recorder.flush()
+        recorder.output(memoryview(b'\x1b[1mbold\x1b[0m'))
+        recorder.resize(30, 100)
+        recorder.close()
+
+        parts = self._parts()
+        self.assertEqual(1, len(parts))
+
+        reader = RecordingReader(parts[0])
+        self.assertEqual((24, 80, compress),
+                         (reader.rows, reader.cols, reader.compressed))
+        self.assertEqual([
+            (OUTPUT, b'login: '),
+            (OUTPUT, b'\x1b[1mbold\x1b[0m'),
+            (RESIZE, b'\x1e\x00\x64\x00'),
+        ], self._records(parts[0]))
+
+    def test_round_trip(self):
+        """The records should be read back in the order of recording. The
+        input should not be recorded unless asked to.
+        """
+        self._check_round_trip(compress=True)
+
+    def test_uncompressed(self):
+        """Compressing the records should be optional. """
+        self._check_round_trip(compress=False)
+
+    def test_input(self):
+        """The input should be recorded, if asked to. """
+        recorder = Recorder(self._prefix, 24, 80, record_input=True)
+        recorder.input(b'ls\r')
+        recorder.close()
+
+        self.assertEqual([(INPUT, b'ls\r')], self._records(self._parts()[0]))
+
+    def test_rotation(self):
+        """The recording should be split into the files of the specified
+        size.
+        """
+        recorder = Recorder(self._prefix, 24, 80, compress=False,
+                            max_bytes=50)
+        for i in range(10):
+            recorder.output(str(i).encode() * 50)
+            recorder.flush()
+        recorder.close()
+
+        parts = self._parts()
+        self.assertEqual(10, len(parts))
+        records = [r for part in parts for r in self._records(part)]
+        self.assertEqual([(OUTPUT, str(i).encode() * 50) for i in range(10)],
+                         records)
+
+    def test_truncated(self):
+        """The incomplete record at the end of the file should be skipped. """
+        recorder = Recorder(self._prefix, 24, 80, compress=False)
+        recorder.output(b'first')
+        recorder.output(b'second')
+        recorder.close()
+
+        path = self._parts()[0]
+        with open(path, 'r+b') as f:
+            f.truncate(os.path.getsize(path) - 1)
+
+        self.assertEqual([(OUTPUT, b'first')], self._records(path))
+
+    def test_not_recording(self):
+        """Reading a file of another format should fail. """
+        path = os.path.join(self._dir, 'file')
+        with open(path, 'wb') as f:
+            f.write(b'x' * 100)
+
+        self.assertRaises(RecordingError, RecordingReader, path)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,127 @@
+#!/usr/bin/python3
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import os
+import pickle
+import shutil
+import tempfile
+import unittest
+
+from gits.recording import (
+    HEADER,
+    MAGIC,
+    OUTPUT,
+    RECORD,
+    RESIZE,
+    SIZE,
+    VERSION,
+)
+from gits.replay import KEYFRAMES_SUFFIX, Replay
+from gits.terminal import Terminal
+from gits.test.helper import Helper
+
+
+class TestReplay(Helper):
+    def setUp(self):
+        super().setUp()
+        self._dir = tempfile.mkdtemp()
+        self._path = os.path.join(self._dir, 'session.0.gitsrec')
+
+        # One line of output per second, the screen is resized at 30 s.
+        self._records = []
+        for i in range(60):
+            self._records.append((OUTPUT, i * 1000,
+                                  'line {} \x1b[1mé'.format(i).encode()))
+        self._records.insert(31, (RESIZE, 30000, SIZE.pack(10, 40)))
+        self._records.append((OUTPUT, 59000, '\r\n'.encode()))
+
+        with open(self._path, 'wb') as f:
+            f.write(HEADER.pack(MAGIC, VERSION, 0, self._rows, self._cols, 0))
+            for kind, ms, data in self._records:
+                f.write(RECORD.pack(kind, ms, len(data)) + data)
+
+    def tearDown(self):
+        shutil.rmtree(self._dir)
+
+    def _expected(self, ms):
+        term = Terminal(self._rows, self._cols)
+        for kind, record_ms, data in self._records:
+            if record_ms > ms:
+                break
+            if kind == RESIZE:
+                term.resize(*SIZE.unpack(data))
+            else:
+                term.feed(data)
+        return term
+
+    def test_state(self):
+        """Restoring the state of a terminal should reproduce its screen and
+        continue parsing where it stopped.
+        """
+        term = self._terminal
+        term.feed(b'\x1b[2;10r\x1b[5;5Hab\x1b[4m\x1b[1')
+
+        restored = Terminal(3, 3)
+        restored.set_state(term.get_state())
+        for t in (term, restored):
+            t.feed(b'0mc\xc3')
+            t.feed(b'\xa9')
+
+        self.assertEqual(term.generate_html(b''),
+                         restored.generate_html(b''))
+        self.assertEqual(term.get_state(), restored.get_state())
+
+    def test_seek(self):
+        """Seeking should restore the same screen as feeding the recording
+        from the start, before and after the keyframes.
+        """
+        replay = Replay([self._path], keyframe_ms=10000, cache=False)
+        self.assertEqual(59000, replay.duration)
+        self.assertGreater(len(replay._keyframes), 4)
+
+        for ms in (0, 999, 5000, 10000, 29999, 30000, 45500, 59000, 10 ** 6):
+            self.assertEqual(self._expected(ms).generate_html(b''),
+                             replay.render_html(ms), ms)
+
+    def test_keyframes_cache(self):
+        """The keyframes should be stored next to the recording and used by
+        the next replay.
+        """
+        Replay([self._path], keyframe_bytes=100)
+        self.assertTrue(os.path.exists(self._path + KEYFRAMES_SUFFIX))
+
+        replay = Replay([self._path], keyframe_bytes=100)
+        replay._build_keyframes = None  # must not be called
+        self.assertEqual(self._expected(40000).generate_html(b''),
+                         replay.render_html(40000))
+
+        # No temporary files are left behind.
+        self.assertEqual(['session.0.gitsrec', 'session.0.gitsrec.keyframes'],
+                         sorted(os.listdir(self._dir)))
+
+    def test_keyframes_not_unpickled(self):
+        """The file, which is not a keyframes file (such as a pickle
+        planted next to the recording), should be ignored and replaced.
+        """
+        cache_path = self._path + KEYFRAMES_SUFFIX
+        with open(cache_path, 'wb') as f:
+            pickle.dump(os.system, f)
+
+        replay = Replay([self._path], keyframe_ms=10000)
+        self.assertEqual(self._expected(30000).generate_html(b''),
+                         replay.render_html(30000))
+        with open(cache_path, 'rb') as f:
+            self.assertEqual(b'{', f.read(1))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,78 @@
+#!/usr/bin/python3
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import unittest
+
+from gits.terminal import Terminal
+from gits.test.helper import Helper
+
+
+class TestResize(Helper):
+    def _row_text(self, y, term=None):
+        row = (term or self._terminal)._screen.lines[y]
+        return ''.join(chr(cell & 0xFFFFFFFF) for cell in row).rstrip('\x00')
+
+    def test_keeps_content(self):
+        """Growing and shrinking the width should keep the rows, cut to the
+        new width.
+        """
+        term = self._terminal
+        term.feed(b'first\r\nsecond row')
+
+        term.resize(self._rows, 100)
+        self.assertEqual(100, len(term._screen.lines[0]))
+        self.assertEqual('first', self._row_text(0))
+        self.assertEqual('second row', self._row_text(1))
+
+        term.resize(self._rows, 3)
+        self.assertEqual('fir', self._row_text(0))
+        self.assertEqual('sec', self._row_text(1))
+        self.assertEqual(self._rows * 3, len(term._screen))
+
+    def test_shorter_screen(self):
+        """The rows above the cursor should be moved to the scrollback when
+        the cursor doesn't fit into the shorter screen.
+        """
+        term = Terminal(self._rows, self._cols, 10)
+        for i in range(self._rows):
+            term.feed('line {}\r\n'.format(i).encode())
+
+        term.resize(10, self._cols)
+        self.assertEqual(9, term._cur_y)
+        self.assertEqual('line 23', self._row_text(8, term))
+        self.assertEqual(9, term._bottom_most)
+        self.assertEqual(10, term.get_scrollback_size())
+
+    def test_clamps_cursor_and_region(self):
+        """The cursor and the scrolling region should stay on the screen. """
+        term = self._terminal
+        term.feed(b'\x1b[5;20r\x1b[3;70H')
+
+        term.resize(self._rows, 40)
+        self.assertEqual((39, 2), (term._cur_x, term._cur_y))
+
+        term.resize(10, 40)
+        self.assertEqual((4, 9), (term._top_most, term._bottom_most))
+
+    def test_full_patch(self):
+        """The next patch should contain all the rows of the new screen. """
+        term = self._terminal
+        term.generate_patch()
+
+        term.resize(5, 10)
+        patch = term.generate_patch(b'hello')
+        self.assertEqual(set(range(5)), set(patch['rows']))
+        self.assertEqual([5, 0], patch['cursor'])
+
+if __name__ == '__main__':
+    unittest.main()
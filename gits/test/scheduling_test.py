@@ -0,0 +1,347 @@
+#!/usr/bin/python3
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import concurrent.futures
+import unittest
+
+from gits.metrics import Counter
+from gits.scheduling import (INTERACTIVE_FACTOR, Backpressure, FairShare,
+                             RenderScheduler, SerialExecutor, Usage)
+from gits.test.helper import FakeIOLoop
+
+
+class FakeExecutor:
+    """Keeps the submitted jobs until they are run by ``run``. """
+
+    def __init__(self):
+        self.jobs = []
+
+    def submit(self, fn, *args):
+        future = concurrent.futures.Future()
+        self.jobs.append((future, fn, args))
+        return future
+
+    def run(self, io_loop):
+        """Runs the oldest job and passes its future to the callback the
+        job was added to ``io_loop`` with.
+        """
+        future, fn, args = self.jobs.pop(0)
+        future.set_result(fn(*args))
+        for i, (f, callback) in enumerate(io_loop.futures):
+            if f is future:
+                del io_loop.futures[i]
+                callback(future)
+                break
+
+
+class TestRenderScheduler(unittest.TestCase):
+    def setUp(self):
+        self._io_loop = FakeIOLoop()
+        self._renders = []
+        self._scheduler = RenderScheduler(
+            self._io_loop, lambda: self._renders.append(self._io_loop.time()),
+            max_fps=10, coalesce_ms=5)
+
+    def test_coalesce(self):
+        """The frame should be rendered after the output stops for the
+        coalescing delay.
+        """
+        start = self._io_loop.time()
+        self._scheduler.schedule()
+        self._io_loop.advance(0.003)
+        self._scheduler.schedule()
+        self._io_loop.advance(0.004)
+        self.assertEqual([], self._renders)
+
+        self._io_loop.advance(0.001)
+        self.assertEqual([start + 0.008], self._renders)
+
+    def test_deadline(self):
+        """The frame should be rendered not later than the frame interval
+        after the first unrendered output, even if the output doesn't stop.
+        """
+        start = self._io_loop.time()
+        for _ in range(50):
+            self._scheduler.schedule()
+            self._io_loop.advance(0.004)
+
+        self.assertEqual(start + 0.1, self._renders[0])
+
+    def test_max_fps(self):
+        """The frames should not be rendered more often than ``max_fps``
+        times per second.
+        """
+        self._scheduler.schedule()
+        self._io_loop.advance(0.01)
+        self._scheduler.schedule()
+        self._io_loop.advance(0.01)
+        self.assertEqual(1, len(self._renders))
+
+        self._io_loop.advance(0.1)
+        self.assertEqual(2, len(self._renders))
+        self.assertAlmostEqual(0.1, self._renders[1] - self._renders[0])
+
+    def test_cancel(self):
+        self._scheduler.schedule()
+        self._scheduler.cancel()
+        self._io_loop.advance(1)
+        self.assertEqual([], self._renders)
+        self.assertEqual([], self._io_loop.pending())
+
+
+class TestSerialExecutor(unittest.TestCase):
+    def setUp(self):
+        self._io_loop = FakeIOLoop()
+        self._executor = FakeExecutor()
+        self._jobs = SerialExecutor(self._io_loop, self._executor, 2)
+
+    def test_order(self):
+        """The jobs should run one at a time in the order of submission and
+        their results should be passed to their callbacks.
+        """
+        results = []
+        for i in range(3):
+            self._jobs.submit(results.append, lambda i: i * 10, i)
+
+        self.assertEqual(1, len(self._executor.jobs))
+        for want in ([0], [0, 10], [0, 10, 20]):
+            self._executor.run(self._io_loop)
+            self.assertEqual(want, results)
+            self.assertLessEqual(len(self._executor.jobs), 1)
+
+    def test_is_full(self):
+        """The executor should be full when the number of the jobs waiting
+        for the running one reaches the limit.
+        """
+        for _ in range(2):
+            self._jobs.submit(lambda result: None, lambda: None)
+            self.assertFalse(self._jobs.is_full())
+
+        self._jobs.submit(lambda result: None, lambda: None)
+        self.assertTrue(self._jobs.is_full())
+
+        self._executor.run(self._io_loop)
+        self.assertFalse(self._jobs.is_full())
+
+    def test_callback_sees_next_job(self):
+        """The next job should be started before the callback is called, so
+        the callback can check if the executor is still full.
+        """
+        fullness = []
+        for _ in range(3):
+            self._jobs.submit(
+                lambda result: fullness.append(self._jobs.is_full()),
+                lambda: None)
+
+        self._executor.run(self._io_loop)
+        self.assertEqual([False], fullness)
+
+
+class TestBackpressure(unittest.TestCase):
+    def setUp(self):
+        self._pauses = []
+        self._renders = 0
+        self._backpressure = Backpressure(100, 40, self._pauses.append,
+                                          self._render)
+        self._backpressure.add('owner')
+
+    def _render(self):
+        self._renders += 1
+
+    def test_pause_and_resume(self):
+        """Reading should be paused when the client reaches the high water
+        mark and resumed, along with rendering, when it drops to the low
+        water mark.
+        """
+        backpressure = self._backpressure
+        backpressure.queued('owner', 99)
+        self.assertEqual([], self._pauses)
+
+        backpressure.queued('owner', 1)
+        self.assertEqual([True], self._pauses)
+        self.assertTrue(backpressure.paused)
+
+        backpressure.sent('owner', 59)
+        self.assertTrue(backpressure.paused)
+
+        backpressure.sent('owner', 1)
+        self.assertEqual([True, False], self._pauses)
+        self.assertEqual(1, self._renders)
+
+    def test_pause_when_all_lag(self):
+        """Reading should not be paused while any client keeps up. """
+        backpressure = self._backpressure
+        backpressure.add('viewer', stale=True)
+        backpressure.queued('owner', 100)
+        self.assertFalse(backpressure.paused)
+
+        backpressure.queued('viewer', 100)
+        self.assertTrue(backpressure.paused)
+
+        # The client keeping up leaves.
+        backpressure.sent('viewer', 100)
+        self.assertFalse(backpressure.paused)
+        backpressure.remove('viewer')
+        self.assertTrue(backpressure.paused)
+
+    def test_full_screen_after_catching_up(self):
+        """The lagging client should be skipped and get the full screen once
+        it catches up.
+        """
+        backpressure = self._backpressure
+        backpressure.add('viewer')
+        self.assertEqual([('owner', False), ('viewer', False)],
+                         backpressure.select())
+
+        backpressure.queued('viewer', 150)
+        self.assertTrue(backpressure.is_lagging('viewer'))
+        self.assertEqual([('owner', False)], backpressure.select())
+
+        backpressure.sent('viewer', 100)
+        self.assertEqual(0, self._renders)
+        backpressure.sent('viewer', 10)
+        self.assertEqual(1, self._renders)
+        self.assertEqual([('owner', False), ('viewer', True)],
+                         backpressure.select())
+        self.assertTrue(backpressure.deliver('viewer', True))
+        self.assertEqual([('owner', False), ('viewer', False)],
+                         backpressure.select())
+
+    def test_deliver(self):
+        """The client, which has become stale since the frame was rendered,
+        should skip the frame. The frames are not delivered to the clients
+        which have left.
+        """
+        backpressure = self._backpressure
+        backpressure.add('viewer')
+        clients = backpressure.select()
+
+        backpressure.queued('viewer', 100)
+        backpressure.select()
+        self.assertEqual([True, False],
+                         [backpressure.deliver(c, f) for c, f in clients])
+
+        backpressure.remove('viewer')
+        self.assertFalse(backpressure.deliver('viewer', True))
+
+    def test_new_viewer(self):
+        backpressure = self._backpressure
+        backpressure.add('viewer', stale=True)
+        self.assertEqual([('owner', False), ('viewer', True)],
+                         backpressure.select())
+
+
+class TestFairShare(unittest.TestCase):
+    def setUp(self):
+        self._io_loop = FakeIOLoop()
+        self._fair_share = FairShare(self._io_loop, tick_bytes=100,
+                                     tick_cpu_ms=10)
+        self._usage = Usage()
+        self._resumed = []
+
+    def tearDown(self):
+        self._fair_share.close()
+
+    def _resume(self):
+        self._resumed.append(self._io_loop.time())
+
+    def test_throttle_and_resume(self):
+        """The terminal exceeding its budget should be resumed in the next
+        tick with the fresh budget.
+        """
+        self.assertFalse(self._fair_share.charge(self._usage, 60))
+        self.assertTrue(self._fair_share.charge(self._usage, 40))
+
+        self._fair_share.throttle(self._usage, self._resume)
+        self._fair_share.throttle(self._usage, self._resume)
+        self.assertEqual(1, self._usage.throttled)
+        self.assertEqual([], self._resumed)
+
+        self._io_loop.advance(0.1)
+        self.assertEqual(1, len(self._resumed))
+        self.assertFalse(self._fair_share.charge(self._usage, 60))
+        self.assertEqual(160, self._usage.bytes)
+
+        # The terminal is resumed only once.
+        self._io_loop.advance(0.1)
+        self.assertEqual(1, len(self._resumed))
+
+    def test_cpu(self):
+        self.assertFalse(self._fair_share.charge(self._usage, cpu=0.005))
+        self.assertTrue(self._fair_share.charge(self._usage, cpu=0.005))
+
+    def test_forget(self):
+        self._fair_share.throttle(self._usage, self._resume)
+        self._fair_share.forget(self._resume)
+        self._io_loop.advance(0.1)
+        self.assertEqual([], self._resumed)
+
+    def test_interactive(self):
+        """The budget of the terminal the user has typed into recently
+        should be larger, until the terminal stops being interactive.
+        """
+        self._fair_share.on_input(self._usage)
+        budget = 100 * INTERACTIVE_FACTOR
+        self.assertFalse(self._fair_share.charge(self._usage, budget - 1))
+        self.assertTrue(self._fair_share.charge(self._usage, 1))
+
+        self._io_loop.advance(2)
+        self.assertTrue(self._fair_share.charge(self._usage, 100))
+
+    def test_bytes_left(self):
+        self.assertEqual(100, self._fair_share.bytes_left(self._usage, 4096))
+        self.assertEqual(10, self._fair_share.bytes_left(self._usage, 10))
+
+        self._fair_share.charge(self._usage, 70)
+        self.assertEqual(30, self._fair_share.bytes_left(self._usage, 4096))
+
+        self._fair_share.charge(self._usage, 50)
+        self.assertEqual(0, self._fair_share.bytes_left(self._usage, 4096))
+
+        self._io_loop.advance(0.1)
+        self.assertEqual(100, self._fair_share.bytes_left(self._usage, 4096))
+
+    def test_ticks(self):
+        """The ticks should be scheduled on the IOLoop given to FairShare
+        and stop when it's closed.
+        """
+        start = self._io_loop.time()
+        self.assertEqual([start + 0.1], self._io_loop.pending())
+        self._io_loop.advance(0.25)
+        pending = self._io_loop.pending()
+        self.assertEqual(1, len(pending))
+        self.assertAlmostEqual(start + 0.3, pending[0])
+
+        self._fair_share.close()
+        self.assertEqual([], self._io_loop.pending())
+
+    def test_counters(self):
+        cpu = Counter('cpu', '')
+        throttled = Counter('throttled', '')
+        fair_share = FairShare(self._io_loop, tick_bytes=100,
+                               cpu=cpu, throttled=throttled)
+        self.addCleanup(fair_share.close)
+
+        fair_share.charge(self._usage, 10, 0.5)
+        fair_share.throttle(self._usage, self._resume)
+        fair_share.throttle(self._usage, self._resume)
+        self.assertEqual((0.5, 1), (cpu.value, throttled.value))
+
+    def test_unlimited(self):
+        fair_share = FairShare(self._io_loop, tick_bytes=0, tick_cpu_ms=0)
+        fair_share.close()
+        self.assertFalse(fair_share.charge(self._usage, 10 ** 9, 10.0))
+        self.assertEqual(4096, fair_share.bytes_left(self._usage, 4096))
+
+if __name__ == '__main__':
+    unittest.main()
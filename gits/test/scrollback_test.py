@@ -0,0 +1,112 @@
+#!/usr/bin/python3
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import unittest
+
+from gits.terminal import Terminal
+from gits.test.helper import Helper
+
+
+class TestScrollback(Helper):
+    def setUp(self):
+        super().setUp()
+        self._scrollback = 10
+        self._terminal = Terminal(self._rows, self._cols, self._scrollback)
+
+    def _feed_lines(self, n):
+        for i in range(n):
+            self._terminal.feed('line {}\r\n'.format(i).encode())
+
+    def _row_text(self, row):
+        return ''.join(chr(cell & 0xFFFFFFFF) for cell in row)
+
+    def test_max_memory_size(self):
+        """The maximum memory size should count the full scrollback no
+        matter how many rows it has yet.
+        """
+        term = self._terminal
+        want = (self._rows + self._scrollback) * self._cols * 8
+
+        self.assertEqual(want, term.get_max_memory_size())
+        self._feed_lines(self._rows * 2)
+        self.assertEqual(want, term.get_max_memory_size())
+
+    def test_disabled_by_default(self):
+        """The terminal should not keep the scrollback unless asked to. """
+        term = Terminal(self._rows, self._cols)
+        term.feed(b'\r\n' * self._rows * 2)
+
+        self.assertEqual(0, term.get_scrollback_size())
+        self.assertEqual([], term.get_scrollback())
+
+    def test_rows_scrolled_off(self):
+        """The rows scrolled off the top of the screen should be put into the
+        scrollback without the trailing blank cells.
+        """
+        term = self._terminal
+        self._feed_lines(self._rows + 2)
+
+        self.assertEqual(3, term.get_scrollback_size())
+        rows = term.get_scrollback()
+        self.assertEqual(['line 0', 'line 1', 'line 2'],
+                         [self._row_text(row) for row in rows])
+
+    def test_ring(self):
+        """The scrollback should keep only the most recent rows. """
+        term = self._terminal
+        self._feed_lines(self._rows + 25)
+
+        self.assertEqual(self._scrollback, term.get_scrollback_size())
+        rows = term.get_scrollback(-2)
+        self.assertEqual(['line 24', 'line 25'],
+                         [self._row_text(row) for row in rows])
+
+    def test_scrolling_region(self):
+        """The rows scrolled off a scrolling region, which doesn't start at the
+        top of the screen, should not be put into the scrollback.
+        """
+        term = self._terminal
+        term.feed(b'\x1b[2;10r\x1b[10;1H')
+        self._feed_lines(5)
+
+        self.assertEqual(0, term.get_scrollback_size())
+
+    def test_scrollback_html(self):
+        """The screen scrolled back should consist of the last rows of the
+        scrollback followed by the first rows of the screen.
+        """
+        term = self._terminal
+        self._feed_lines(self._rows + 2)
+
+        got = term.generate_scrollback_html(2)
+        self.assertEqual(2, got['offset'])
+        self.assertEqual(3, got['size'])
+        self.assertEqual(self._rows, len(got['rows']))
+        self.assertIn('line\xa01', got['rows'][0])
+        self.assertIn('line\xa03', got['rows'][2])
+
+        # The offset can't exceed the size of the scrollback.
+        got = term.generate_scrollback_html(100)
+        self.assertEqual(3, got['offset'])
+        self.assertIn('line\xa00', got['rows'][0])
+
+    def test_blank_rows(self):
+        """Blank rows should take no space in the scrollback. """
+        term = self._terminal
+        term.feed(b'\r\n' * self._rows)
+
+        self.assertEqual(1, term.get_scrollback_size())
+        self.assertEqual(0, len(term.get_scrollback()[0]))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,327 @@
+#!/usr/bin/python3
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import fcntl
+import os
+import unittest
+from unittest import mock
+
+from gits.scheduling import FairShare, SerialExecutor, Usage
+from gits.sessions import DetachedSessions, ShellPool
+from gits.terminal import Terminal
+from gits.test.helper import FakeIOLoop
+from gits.test.scheduling_test import FakeExecutor
+
+
+def _nonblocking_pipe():
+    r, w = os.pipe()
+    fcntl.fcntl(r, fcntl.F_SETFL, os.O_NONBLOCK)
+    return r, w
+
+
+class TestDetachedSessions(unittest.TestCase):
+    def setUp(self):
+        self._io_loop = FakeIOLoop()
+        # The ticks run on their own loop, so they are not counted among
+        # the timeouts of the detached terminals.
+        self._ticks = FakeIOLoop()
+        self._fair_share = FairShare(self._ticks, tick_bytes=1000)
+        self._sessions = {}
+        self._destroyed = []
+        self._pipes = []  # the tuples (read fd, write fd)
+        self._detached = self._create_detached(max_count=3,
+                                               max_bytes=10 ** 9)
+
+    def tearDown(self):
+        self._fair_share.close()
+        for fds in self._pipes:
+            for fd in fds:
+                try:
+                    os.close(fd)
+                except OSError:
+                    pass
+
+    def _create_detached(self, max_count, max_bytes):
+        return DetachedSessions(self._io_loop, self._sessions,
+                                self._destroyed.append, self._fair_share,
+                                grace=60, max_count=max_count,
+                                max_bytes=max_bytes)
+
+    def _add_session(self, token, jobs=None):
+        """Creates a session reading from a pipe. Returns the fds of the
+        read and write ends of the pipe.
+        """
+        r, w = _nonblocking_pipe()
+        self._pipes.append((r, w))
+        self._sessions[r] = {
+            'token': token,
+            'terminal': Terminal(24, 80),
+            'usage': Usage(),
+            'recorder': None,
+            'jobs': jobs,
+        }
+        return r, w
+
+    def _read(self, fd):
+        handler, events = self._io_loop.handlers[fd]
+        self.assertEqual(self._io_loop.READ, events)
+        handler(fd, events)
+
+    def test_attach(self):
+        fd, _ = self._add_session('a')
+        self._detached.detach(fd)
+        self.assertEqual(1, len(self._detached))
+        self.assertIn(fd, self._io_loop.handlers)
+
+        self.assertIsNone(self._detached.attach('b'))
+        self.assertEqual(fd, self._detached.attach('a'))
+        self.assertEqual(0, len(self._detached))
+        self.assertNotIn(fd, self._io_loop.handlers)
+        self.assertEqual([], self._io_loop.pending())
+
+        self._io_loop.advance(120)
+        self.assertEqual([], self._destroyed)
+
+    def test_grace(self):
+        """The terminal should be hung up when no one reattaches to it
+        during the grace period.
+        """
+        fd, _ = self._add_session('a')
+        self._detached.detach(fd)
+        self._io_loop.advance(59)
+        self.assertEqual([], self._destroyed)
+
+        self._io_loop.advance(1)
+        self.assertEqual([fd], self._destroyed)
+        self.assertIsNone(self._detached.attach('a'))
+        self.assertNotIn(fd, self._io_loop.handlers)
+
+    def test_evict_by_count(self):
+        """The terminals detached earliest should be hung up when there are
+        too many detached terminals.
+        """
+        fds = [self._add_session(token)[0] for token in 'abcde']
+        for fd in fds:
+            self._detached.detach(fd)
+
+        self.assertEqual(fds[:2], self._destroyed)
+        self.assertEqual(3, len(self._detached))
+        self.assertEqual(fds[2], self._detached.attach('c'))
+
+    def test_evict_by_bytes(self):
+        """The terminals detached earliest should be hung up when the
+        detached terminals take too much memory.
+        """
+        size = Terminal(24, 80).get_max_memory_size()
+        self._detached = self._create_detached(max_count=10,
+                                               max_bytes=size * 2)
+        fds = [self._add_session(token)[0] for token in 'abc']
+        for fd in fds:
+            self._detached.detach(fd)
+
+        self.assertEqual(fds[:1], self._destroyed)
+        self.assertEqual(2, len(self._detached))
+
+        # Attaching frees the memory.
+        self._detached.attach('b')
+        fd, _ = self._add_session('d')
+        self._detached.detach(fd)
+        self.assertEqual(fds[:1], self._destroyed)
+
+    def test_read(self):
+        """The output of the detached terminal should be fed to it and the
+        terminal should be hung up when the shell exits.
+        """
+        fd, w = self._add_session('a')
+        self._detached.detach(fd)
+        os.write(w, b'hello')
+        self._read(fd)
+
+        session = self._sessions[fd]
+        self.assertEqual(5, session['usage'].bytes)
+        self.assertEqual(ord('h'), session['terminal']._screen[0] & 0xffff)
+
+        os.close(w)
+        self._read(fd)
+        self.assertEqual([fd], self._destroyed)
+        self.assertEqual(0, len(self._detached))
+
+    def test_throttle(self):
+        """Reading from the detached terminal exceeding its budget should
+        pause until the next tick.
+        """
+        fd, w = self._add_session('a')
+        self._detached.detach(fd)
+        os.write(w, b'x' * 1500)
+
+        self._read(fd)
+        self.assertEqual(1000, self._sessions[fd]['usage'].bytes)
+        self.assertEqual(0, self._io_loop.handlers[fd][1])
+
+        self._ticks.advance(0.1)
+        self._read(fd)
+        self.assertEqual(1500, self._sessions[fd]['usage'].bytes)
+        self.assertEqual(self._io_loop.READ, self._io_loop.handlers[fd][1])
+
+    def test_forget_throttled(self):
+        """The terminal throttled while detached should not be resumed
+        after it's attached.
+        """
+        fd, w = self._add_session('a')
+        self._detached.detach(fd)
+        os.write(w, b'x' * 1000)
+        self._read(fd)
+
+        self._detached.attach('a')
+        self._io_loop.add_handler(fd, None, 0)
+        self._ticks.advance(0.1)
+        self.assertEqual(0, self._io_loop.handlers[fd][1])
+
+    def test_jobs(self):
+        """Reading should pause while too many feeding jobs are queued and
+        resume when they are done.
+        """
+        executor = FakeExecutor()
+        jobs = SerialExecutor(self._io_loop, executor, 1)
+        fd, w = self._add_session('a', jobs)
+        self._detached.detach(fd)
+
+        os.write(w, b'he')
+        self._read(fd)
+        os.write(w, b'llo')
+        self._read(fd)
+        self.assertEqual(0, self._io_loop.handlers[fd][1])
+
+        executor.run(self._io_loop)
+        self.assertEqual(self._io_loop.READ, self._io_loop.handlers[fd][1])
+        terminal = self._sessions[fd]['terminal']
+        self.assertEqual(ord('h'), terminal._screen[0] & 0xffff)
+
+    def test_close(self):
+        fds = [self._add_session(token)[0] for token in 'ab']
+        for fd in fds:
+            self._detached.detach(fd)
+
+        self._detached.close()
+        self.assertEqual(fds, self._destroyed)
+        self.assertEqual({}, self._io_loop.handlers)
+        self.assertEqual([], self._io_loop.pending())
+
+    def test_is_enabled(self):
+        self.assertTrue(self._detached.is_enabled())
+        self.assertFalse(self._create_detached(0, 10 ** 9).is_enabled())
+
+
+class TestShellPool(unittest.TestCase):
+    """The shells are replaced with pipes, the write ends of which stand for
+    the shells.
+    """
+
+    def setUp(self):
+        self._io_loop = FakeIOLoop()
+        self._shells = {}  # read fd to write fd
+        self._killed = []
+
+        patchers = [
+            mock.patch('gits.sessions.spawn_shell', self._spawn_shell),
+            mock.patch('gits.sessions.kill_shell', self._kill_shell),
+        ]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        self._pool = ShellPool(self._io_loop, 2, max_idle=60)
+        self.addCleanup(self._pool.close)
+
+    def tearDown(self):
+        for fds in self._shells.items():
+            for fd in fds:
+                try:
+                    os.close(fd)
+                except OSError:
+                    pass
+
+    def _spawn_shell(self, rows, cols):
+        r, w = _nonblocking_pipe()
+        self._shells[r] = w
+        return -r, r
+
+    def _kill_shell(self, pid, fd):
+        self._killed.append(fd)
+
+    def _run_callbacks(self):
+        while self._io_loop.callbacks:
+            callback, args = self._io_loop.callbacks.pop(0)
+            callback(*args)
+
+    def test_refill(self):
+        """The pool should be refilled one shell per IOLoop iteration. """
+        self.assertEqual(1, len(self._io_loop.callbacks))
+        self._run_callbacks()
+        self.assertEqual(2, len(self._shells))
+        self.assertEqual(2, len(self._io_loop.handlers))
+
+        fd = min(self._shells)
+        os.write(self._shells[fd], b'login: ')
+        self._io_loop.handlers[fd][0](fd, self._io_loop.READ)
+
+        pid, claimed, terminal = self._pool.claim()
+        self.assertEqual((-fd, fd), (pid, claimed))
+        self.assertEqual(ord('l'), terminal._screen[0] & 0xffff)
+        self.assertNotIn(fd, self._io_loop.handlers)
+
+        self._run_callbacks()
+        self.assertEqual(3, len(self._shells))
+        self.assertEqual(2, len(self._io_loop.handlers))
+
+    def test_expire(self):
+        """The shells idle for too long should be replaced. """
+        self._run_callbacks()
+        old = sorted(self._shells)
+
+        self._io_loop.advance(60)
+        self.assertEqual([], self._killed)
+
+        self._io_loop.advance(1)
+        self.assertEqual(old, self._killed)
+
+        self._run_callbacks()
+        self.assertEqual(2, len(self._io_loop.handlers))
+        self.assertNotIn(old[0], self._io_loop.handlers)
+
+    def test_exited(self):
+        """The shell which has exited should be replaced. """
+        self._run_callbacks()
+        fd = min(self._shells)
+        os.close(self._shells[fd])
+        self._io_loop.handlers[fd][0](fd, self._io_loop.READ)
+
+        self.assertEqual([fd], self._killed)
+        self._run_callbacks()
+        self.assertEqual(2, len(self._io_loop.handlers))
+
+    def test_empty(self):
+        self._run_callbacks()
+        pool = ShellPool(self._io_loop, 0, max_idle=60)
+        self.assertIsNone(pool.claim())
+        self.assertEqual([], self._io_loop.callbacks)
+        pool.close()
+
+    def test_close(self):
+        self._run_callbacks()
+        self._pool.close()
+        self.assertEqual(sorted(self._shells), self._killed)
+        self.assertEqual([], self._io_loop.pending())
+
+if __name__ == '__main__':
+    unittest.main()
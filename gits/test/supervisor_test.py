@@ -0,0 +1,116 @@
+#!/usr/bin/python3
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import signal
+import unittest
+from unittest import mock
+
+from gits.supervisor import RESTART_DELAY, supervise
+
+
+class TestSupervise(unittest.TestCase):
+    """The processes are not forked. The results of os.fork and os.waitpid
+    are made up by the tests.
+    """
+
+    def setUp(self):
+        self._forks = []  # the pids returned by os.fork in turn
+        self._waits = []  # the results of os.waitpid or the exceptions
+        self._handlers = {}
+        self._killed = []
+        self._now = 100.0
+
+        patchers = [
+            mock.patch('os.fork', self._fork),
+            mock.patch('os.waitpid', self._waitpid),
+            mock.patch('os.kill', self._kill),
+            mock.patch('signal.signal', self._signal),
+            mock.patch('time.monotonic', lambda: self._now),
+            mock.patch('gits.supervisor.app_log'),
+        ]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        patcher = mock.patch('time.sleep')
+        self._sleep = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _fork(self):
+        return self._forks.pop(0)
+
+    def _waitpid(self, pid, options):
+        self.assertEqual((-1, 0), (pid, options))
+        result = self._waits.pop(0)
+        if callable(result):
+            result = result()
+        if isinstance(result, BaseException):
+            raise result
+        return result
+
+    def _kill(self, pid, signum):
+        self._killed.append((pid, signum))
+
+    def _signal(self, signum, handler):
+        self._handlers[signum] = handler
+
+    def test_worker(self):
+        """The worker should get its index and the default signal handlers.
+        """
+        self._forks = [100, 0]
+        self.assertEqual(1, supervise(3))
+        self.assertEqual({signal.SIGTERM: signal.SIG_DFL,
+                          signal.SIGINT: signal.SIG_DFL}, self._handlers)
+
+    def test_restart(self):
+        """The worker which has died should be restarted with its index,
+        after a delay if it has died soon after starting.
+        """
+        self._forks = [100, 101, 102, 0]
+
+        def exit_later():
+            self._now += RESTART_DELAY
+            return 100, 0
+
+        self._waits = [(101, 256), exit_later]
+        self.assertEqual(0, supervise(2))
+        self._sleep.assert_called_once_with(RESTART_DELAY)
+
+    def test_stop(self):
+        """SIGTERM should be forwarded to the workers and the supervisor
+        should exit, without restarting them, after they have exited. The
+        interrupted wait should be retried.
+        """
+        self._forks = [100, 101]
+
+        def interrupt():
+            self._handlers[signal.SIGTERM](signal.SIGTERM, None)
+            return InterruptedError()
+
+        self._waits = [interrupt, (100, 15), (101, 15)]
+        with self.assertRaises(SystemExit) as cm:
+            supervise(2)
+
+        self.assertEqual(0, cm.exception.code)
+        self.assertEqual([(100, signal.SIGTERM), (101, signal.SIGTERM)],
+                         self._killed)
+        self.assertEqual([], self._forks)
+
+    def test_no_children(self):
+        self._forks = [100]
+        self._waits = [ChildProcessError()]
+        with self.assertRaises(SystemExit):
+            supervise(1)
+
+if __name__ == '__main__':
+    unittest.main()
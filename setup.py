@@ -18,7 +18,7 @@ setup(name='gits',
       maintainer_email='Evgeny Golyshev <eugulixes@gmail.com>',
       license='http://www.apache.org/licenses/LICENSE-2.0',
       scripts=['bin/server.py'],
-      packages=['gits'],
+      packages=['gits', 'gits.benchmark'],
       package_data={'gits': ['linux_console.yml']},
       install_requires=[
           'PyYAML',
@@ -1,11 +1,43 @@
 import { Events } from './events';
 
+/* The bits of the emphasis and modes byte. See gits/terminal.py. */
+const UNDERLINE = 1 << 0;
+const REVERSE = 1 << 1;
+const BLINK = 1 << 2;
+const BOLD = 1 << 4;
+
+const _escape = s => s.replace(/&/g, '&amp;')
+                      .replace(/</g, '&lt;')
+                      .replace(/>/g, '&gt;')
+                      .replace(/ /g, '\u00a0');
+
+const _classes = (modes, colors) => {
+    let bg = colors >> 4, fg = colors & 0xF;
+
+    if (modes & REVERSE)
+        [bg, fg] = [fg, bg];
+
+    let classes = 'b' + bg + ' f' + fg;
+
+    if (modes & UNDERLINE)
+        classes += ' underline';
+    if (modes & BLINK)
+        classes += ' blink';
+    if (modes & BOLD)
+        classes += ' bold';
+
+    return classes;
+};
+
 export class Display extends Events {
     constructor($screen, row, col) {
         super();
 
         this._row = row;
         this._col = col;
+        this._$rows = [];
+        this._cursor = [0, 0];
+        this._decoder = new TextDecoder('utf-8');
         this.cellSizeCache = {};
 
         this.$node = document.createElement('pre')
@@ -13,6 +45,16 @@ export class Display extends Events {
 
         $screen.appendChild(this.$node);
 
+        /*
+         * The screen scrolled back is shown instead of the display, so the
+         * display keeps receiving patches in the meantime.
+         */
+        this.$scrollback = document.createElement('pre');
+        this.$scrollback.setAttribute('class', 'terminal-display');
+        this.$scrollback.style.display = 'none';
+
+        $screen.appendChild(this.$scrollback);
+
         this._style = getComputedStyle(this.$node);
     }
 
@@ -51,6 +93,115 @@ export class Display extends Events {
         return cache[font_family][font_size];
     }
 
+    _get_row_node(y) {
+        while (this._$rows.length <= y) {
+            const $row = document.createElement('div');
+            $row.setAttribute('class', 'terminal-row');
+
+            this.$node.appendChild($row);
+            this._$rows.push($row);
+        }
+
+        return this._$rows[y];
+    }
+
+    /*
+     * Applies a patch received from the server. The patch contains the
+     * position of the cursor and the HTML representation of the rows which
+     * have been changed since the previous patch.
+     */
+    applyPatch(patch) {
+        const rows = patch.rows;
+
+        for (const key in rows) {
+            const y = parseInt(key, 10);
+
+            /* The rows outside the screen are ignored. */
+            if (rows.hasOwnProperty(key) && y >= 0 && y < this._row)
+                this._get_row_node(y).innerHTML = rows[key];
+        }
+
+        this._cursor = patch.cursor;
+    }
+
+    /*
+     * Applies a patch received from the server via the binary protocol. See
+     * Terminal.generate_cells_patch in gits/terminal.py for the format.
+     */
+    applyCellsPatch(buffer) {
+        const view = new DataView(buffer);
+        const bytes = new Uint8Array(buffer);
+        const cur_x = view.getUint16(1, true);
+        const cur_y = view.getUint16(3, true);
+        const cur_visible = view.getUint8(5);
+        const row_number = view.getUint16(8, true);
+        let offset = 10;
+
+        for (let i = 0; i < row_number; i++) {
+            const y = view.getUint16(offset, true);
+            const run_number = view.getUint16(offset + 2, true);
+            let html = '';
+            let x = 0;
+
+            offset += 4;
+            for (let j = 0; j < run_number; j++) {
+                const cells = view.getUint16(offset, true);
+                const modes = view.getUint8(offset + 2);
+                const colors = view.getUint8(offset + 3);
+                const length = view.getUint16(offset + 4, true);
+                let text = ' '.repeat(cells);
+
+                offset += 6;
+                if (length)
+                    text = this._decoder.decode(
+                        bytes.subarray(offset, offset + length));
+                offset += length;
+
+                const classes = _classes(modes, colors);
+                if (cur_visible && y == cur_y &&
+                    x <= cur_x && cur_x < x + cells) {
+                    /* Code points don't always match UTF-16 code units. */
+                    const chars = Array.from(text);
+                    const before = chars.slice(0, cur_x - x).join('');
+                    const after = chars.slice(cur_x - x + 1).join('');
+
+                    if (before)
+                        html += '<span class="' + classes + '">' +
+                                _escape(before) + '</span>';
+                    html += '<span class="b1 f7">' +
+                            _escape(chars[cur_x - x]) + '</span>';
+                    if (after)
+                        html += '<span class="' + classes + '">' +
+                                _escape(after) + '</span>';
+                } else {
+                    html += '<span class="' + classes + '">' +
+                            _escape(text) + '</span>';
+                }
+
+                x += cells;
+            }
+
+            if (y < this._row)
+                this._get_row_node(y).innerHTML = html;
+        }
+
+        this._cursor = [cur_x, cur_y];
+    }
+
+    showScrollback(scrollback) {
+        this.$scrollback.innerHTML = scrollback.rows.map(row => {
+            return '<div class="terminal-row">' + row + '</div>';
+        }).join('');
+
+        this.$node.style.display = 'none';
+        this.$scrollback.style.display = '';
+    }
+
+    hideScrollback() {
+        this.$scrollback.style.display = 'none';
+        this.$node.style.display = '';
+    }
+
     getCol() {
         return this._col;
     }
@@ -63,6 +214,10 @@ export class Display extends Events {
         return this._style.getPropertyValue('font-family');
     }
 
+    getCursor() {
+        return this._cursor;
+    }
+
     getRow() {
         return this._row;
     }
@@ -71,6 +226,10 @@ export class Display extends Events {
         this._row = row;
         this._col = col;
 
+        /* The server sends the rows, which fit into the new resolution. */
+        while (this._$rows.length > row)
+            this.$node.removeChild(this._$rows.pop());
+
         /*
          * Changing display resolution requires involvement of both the server
          * and the client. However, the display component doesn't know how to
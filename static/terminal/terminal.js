@@ -20,7 +20,29 @@ export class Terminal {
         });
 
         const _input = new Input(this.screen.$node);
-        const _ws = new WebSocket('ws://' + location.host + '/termsocket');
+        /*
+         * The server keeps the terminal for a while after the connection is
+         * closed, so reloading the page reattaches to the same terminal.
+         * The first message tells the server which terminal to attach to.
+         * The tokens are never put in the URLs sent to the server, so they
+         * don't end up in its logs.
+         */
+        const _session = sessionStorage.getItem('gits.session') || '';
+        let _hello = 'ses,' + _session;
+
+        /*
+         * The page opened with #view=<token> shows the terminal shared by
+         * another client. The tokens for sharing the terminal are kept in
+         * the share property.
+         */
+        const _view = new URLSearchParams(location.hash.slice(1)).get('view');
+        if (_view)
+            _hello = 'viw,' + _view;
+        this.share = null;
+        const _ws = new WebSocket('ws://' + location.host + '/termsocket',
+                                  ['gits.cells']);
+        _ws.onopen = (() => _ws.send(_hello));
+        _ws.binaryType = 'arraybuffer';
 
         /*
          * When entering full-screen mode, figure out an optimal display
@@ -44,12 +66,60 @@ export class Terminal {
             _ws.send('rsz,' + e.row + 'x' + e.col);
         });
 
-        _input.bind('oninput', function(data) {
+        /*
+         * The number of rows the screen is scrolled back by. The server keeps
+         * the scrollback, so the client asks for the rows when the user
+         * scrolls the screen.
+         */
+        let _offset = 0;
+
+        this.screen.$node.addEventListener('wheel', (e => {
+            const offset = Math.max(0, _offset + (e.deltaY < 0 ? 3 : -3));
+
+            e.preventDefault();
+            if (offset == _offset)
+                return;
+
+            _offset = offset;
+            if (_offset)
+                _ws.send('hst,' + _offset);
+            else
+                this.display.hideScrollback();
+        }));
+
+        _input.bind('oninput', (data => {
+            if (_offset) {
+                _offset = 0;
+                this.display.hideScrollback();
+            }
+
             _ws.send(data);
-        });
+        }));
 
         _ws.onmessage = (e => {
-            this.display.$node.innerHTML = e.data;
+            if (e.data instanceof ArrayBuffer) {
+                this.display.applyCellsPatch(e.data);
+                return;
+            }
+
+            const message = JSON.parse(e.data);
+            if (message.session) {
+                sessionStorage.setItem('gits.session', message.session);
+                this.share = message.share;
+            } else if (message.scrollback) {
+                /* The user may have stopped scrolling in the meantime. */
+                if (!_offset)
+                    return;
+
+                /* The scrollback may be shorter than the user scrolled. */
+                _offset = message.scrollback.offset;
+                if (_offset)
+                    this.display.showScrollback(message.scrollback);
+                else
+                    this.display.hideScrollback();
+            } else {
+                this.display.applyPatch(message);
+            }
         });
     }
 };